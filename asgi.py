@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# type: ignore
+"""
+Serves poecalc with asyncio instead of eventlet: the analysis route awaits pathofexile.com with httpx.AsyncClient and
+runs the CPU-bound work in threads (or the analysis pool), every other route runs the WSGI app in a thread
+
+./asgi.py 0.0.0.0 8080 runs it with uvicorn, with POECALC_WORKERS processes
+"""
+import asyncio
+import io
+import os
+import sys
+from collections.abc import Awaitable, Callable
+from typing import Any, Optional
+
+from pigwig import Response
+from pigwig.exceptions import HTTPException
+
+import config
+import poecalc
+import stats
+
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+async def app(scope: dict[str, Any], receive: Receive, send: Send) -> None:
+	if scope['type'] == 'lifespan':
+		await _lifespan(receive, send)
+		return
+	if scope['type'] != 'http':
+		raise ValueError(f'unsupported ASGI scope type {scope["type"]}')
+
+	environ = _environ(scope, await _read_body(receive))
+	response = await _call_async_route(environ)
+	if response is None:
+		await _call_wsgi(environ, send)
+		return
+	body = response.body
+	if isinstance(body, str):
+		body = body.encode('utf-8')
+	await send({'type': 'http.response.start', 'status': response.code, 'headers': _encode_headers(response.headers)})
+	if hasattr(body, '__aiter__'):
+		try:
+			async for chunk in body:
+				await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+		finally:
+			await body.aclose()
+		await send({'type': 'http.response.body', 'body': b''})
+		return
+	await send({'type': 'http.response.body', 'body': body or b''})
+
+
+async def _lifespan(receive: Receive, send: Send) -> None:
+	while True:
+		message = await receive()
+		if message['type'] == 'lifespan.startup':
+			await send({'type': 'lifespan.startup.complete'})
+		elif message['type'] == 'lifespan.shutdown':
+			await stats.async_client.aclose()
+			await asyncio.to_thread(poecalc.analysis_pool.shutdown)
+			await send({'type': 'lifespan.shutdown.complete'})
+			return
+
+
+async def _read_body(receive: Receive) -> bytes:
+	chunks = []
+	while True:
+		message = await receive()
+		chunks.append(message.get('body', b''))
+		if not message.get('more_body'):
+			return b''.join(chunks)
+
+
+def _environ(scope: dict[str, Any], body: bytes) -> dict[str, Any]:
+	server_name, server_port = scope.get('server') or ('localhost', 80)
+	environ = {
+		'REQUEST_METHOD': scope['method'],
+		'SCRIPT_NAME': scope.get('root_path', ''),
+		# WSGI strings are bytes decoded as latin1 (PEP 3333)
+		'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+		'QUERY_STRING': scope['query_string'].decode('latin1'),
+		'SERVER_NAME': server_name,
+		'SERVER_PORT': str(server_port),
+		'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+		'wsgi.version': (1, 0),
+		'wsgi.url_scheme': scope.get('scheme', 'http'),
+		'wsgi.input': io.BytesIO(body),
+		'wsgi.errors': sys.stderr,
+		'wsgi.multithread': True,
+		'wsgi.multiprocess': True,
+		'wsgi.run_once': False,
+	}
+	if scope.get('client'):
+		environ['REMOTE_ADDR'] = scope['client'][0]
+	for raw_name, raw_value in scope['headers']:
+		name = raw_name.decode('latin1').upper().replace('-', '_')
+		value = raw_value.decode('latin1')
+		if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+			name = 'HTTP_' + name
+		environ[name] = environ[name] + ',' + value if name in environ else value
+	return environ
+
+
+async def _call_async_route(environ: dict[str, Any]) -> Optional[Response]:
+	""" Runs the handler in poecalc.async_routes for this request, if there is one """
+	# building the request reads the body, which the WSGI app has to read itself for every other route
+	try:
+		path = environ['PATH_INFO'].encode('latin1').decode('utf-8')
+		handler, kwargs = poecalc.app.routes.route(environ['REQUEST_METHOD'], path)
+	except (UnicodeDecodeError, HTTPException):
+		return None
+	async_handler = poecalc.async_routes.get(handler)
+	if async_handler is None:
+		return None
+
+	request, err = poecalc.app.build_request(environ)
+	errors = environ['wsgi.errors']
+	try:
+		try:
+			if err is not None:
+				raise err
+			return await async_handler(request, **kwargs)
+		except HTTPException as e:
+			return poecalc.app.http_exception_handler(e, errors, request, poecalc.app)
+	except Exception as e:
+		return poecalc.app.exception_handler(e, errors, request, poecalc.app)
+
+
+async def _call_wsgi(environ: dict[str, Any], send: Send) -> None:
+	status_and_headers = []
+	def start_response(status: str, headers: list[tuple[str, str]], exc_info: Any = None) -> None:
+		status_and_headers[:] = [int(status.split(' ', 1)[0]), headers]
+
+	body = await asyncio.to_thread(poecalc.app, environ, start_response)
+	status, headers = status_and_headers
+	await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+	if isinstance(body, list):
+		await send({'type': 'http.response.body', 'body': b''.join(body)})
+		return
+	# generators (e.g. streamed responses) may block between chunks
+	chunks = iter(body)
+	while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+		await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+	await send({'type': 'http.response.body', 'body': b''})
+
+
+def _encode_headers(headers: list[tuple[str, str]]) -> list[tuple[bytes, bytes]]:
+	return [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+
+def main() -> None:
+	import uvicorn  # only needed when running this file, any ASGI server can serve app
+
+	workers = config.workers or os.cpu_count() or 1
+	if workers > 1 and config.upstream_cache_path:
+		# uvicorn's worker processes can't be told apart to give each its own file, and can't share one
+		print('not persisting the upstream cache with more than one worker', file=sys.stderr)
+		os.environ['POECALC_UPSTREAM_CACHE_PATH'] = ''
+	uvicorn.run('asgi:app', host=sys.argv[1], port=int(sys.argv[2]), workers=workers)
+
+
+if __name__ == '__main__':
+	main()
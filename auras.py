@@ -1,15 +1,59 @@
 import re
+from typing import Optional
 
 import gems
 import stats
 
+def analyze_character(char: dict, skills: dict, alternate_skill_tree: bool,
+        aura_effect: Optional[int] = None) -> dict[str, list[list[str]]]:
+    """Runs every analysis for a character from its get-items and get-passive-skills responses"""
+    char_stats, char, skills, alternate_skill_tree = stats.stats_for_character(char, skills, alternate_skill_tree)
+    if aura_effect is not None:
+        char_stats.aura_effect = aura_effect
+
+    active_skills = []
+    for item in char['items']:
+        active_skills += gems.parse_skills_in_item(item, char_stats)
+
+    analyzer = Auras()
+    aura_results, vaal_aura_results = analyzer.analyze_auras(
+            char_stats, char, active_skills, skills, alternate_skill_tree)
+    return {
+        'results': aura_results,
+        'vaal_results': vaal_aura_results,
+        'curse_results': analyzer.analyze_curses(char_stats, active_skills),
+        'mine_results': analyzer.analyze_mines(char_stats, active_skills),
+        'link_results': analyzer.analyze_links(char_stats, active_skills),
+    }
+
+
+def sweep_character(char: dict, skills: dict, alternate_skill_tree: bool, aura_effects: list[int]) -> dict[str, list]:
+    """The auras of a character for every increased aura effect in aura_effects, see SkillGem.sweep_aura"""
+    char_stats, char, skills, alternate_skill_tree = stats.stats_for_character(char, skills, alternate_skill_tree)
+    active_skills = []
+    for item in char['items']:
+        active_skills += gems.parse_skills_in_item(item, char_stats)
+
+    results = []
+    vaal_results = []
+    # same gems in the same order as analyze_auras, since every get_aura adds alternate quality effects again
+    for gem in active_skills:
+        if 'aura' in gem.tags and not {'curse', 'remotemined'} & gem.tags:
+            if result := gem.sweep_aura(False, aura_effects):
+                results.append(result)
+            if 'vaal' in gem.tags and (result := gem.sweep_aura(True, aura_effects)):
+                vaal_results.append(result)
+    return {'aura_effects': aura_effects, 'results': results, 'vaal_results': vaal_results}
+
+
 class Auras:
 
     def analyze_auras(self, char_stats: stats.Stats, char: dict, active_skills: list[gems.SkillGem], skills: dict,
             alternate_skill_tree: bool) -> tuple[list[list[str]], list[list[str]]]:
         aura_counter = []
 
-        results = [[f'// character increased aura effect: {char_stats.aura_effect}%']]
+        results: list[list[str]] = [gems.Result([f'// character increased aura effect: {char_stats.aura_effect}%'],
+                {'type': 'character', 'effect': char_stats.aura_effect})]
         vaal_results = []
         for gem in active_skills:
             if gem.applies_to_allies():
@@ -34,7 +78,8 @@ class Auras:
     def analyze_curses(char_stats: stats.Stats, active_skills: list[gems.SkillGem]) -> list[list[str]]:
         curse_effect = round(
             ((1 + char_stats.inc_curse_effect / 100) * (1 + char_stats.more_curse_effect / 100) - 1) * 100)
-        results = [[f'// character increased curse effect: {curse_effect}%']]
+        results: list[list[str]] = [gems.Result([f'// character increased curse effect: {curse_effect}%'],
+                {'type': 'character', 'effect': curse_effect})]
         for gem in active_skills:
             if 'curse' in gem.tags:
                 results.append(gem.get_curse())
@@ -45,7 +90,8 @@ class Auras:
     @staticmethod
     def analyze_mines(char_stats: stats.Stats, active_skills: list[gems.SkillGem]) -> list[list[str]]:
         effect = char_stats.aura_effect + char_stats.mine_aura_effect + char_stats.aura_effect_on_enemies
-        results = [[f'// character increased aura effect for mines: {effect}%']]
+        results: list[list[str]] = [gems.Result([f'// character increased aura effect for mines: {effect}%'],
+                {'type': 'character', 'effect': effect})]
         for gem in active_skills:
             if 'remotemined' in gem.tags:
                 results.append(gem.get_mine())
@@ -55,7 +101,7 @@ class Auras:
 
     @staticmethod
     def analyze_links(char_stats: stats.Stats, active_skills: list[gems.SkillGem]) -> list[list[str]]:
-        results = [['// Effects from Link Skills:']]
+        results: list[list[str]] = [gems.Result(['// Effects from Link Skills:'], {'type': 'character'})]
         for gem in active_skills:
             if 'link' in gem.tags:
                 results.append(gem.get_link())
@@ -66,7 +112,8 @@ class Auras:
         if char_stats.link_exposure:
             additional_results.append('Nearby Enemies have -10% to Elemental Resistances')
         if additional_results:
-            results.append(['// Additional Link effects', *additional_results])
+            results.append(gems.Result(['// Additional Link effects', *additional_results],
+                    {'type': 'link_exposure'}))
         return results
 
     @staticmethod
@@ -149,7 +196,7 @@ class Auras:
         }
         if node_name not in ascendancies:
             return []
-        return [f'// {node_name}'] + ascendancies[node_name]
+        return gems.Result([f'// {node_name}', *ascendancies[node_name]], {'type': 'ascendancy', 'name': node_name})
 
     @staticmethod
     def item_aura(item: dict, char_stats: stats.Stats, aura_counter: list) -> list[str]:
@@ -181,7 +228,8 @@ class Auras:
                     # TODO: crown of the tyrant
                     aura_string.append(m.group(2))
         if aura_string:
-            aura_string = [f'// {item["name"]} {item["typeLine"]}', *aura_string]
+            aura_string = gems.Result([f'// {item["name"]} {item["typeLine"]}', *aura_string],
+                    {'type': 'item', 'name': item['name'], 'type_line': item['typeLine'], 'slot': item['inventoryId']})
         return aura_string
 
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Analyzes saved characters without going through the website
+
+Every input record is a JSON object with the get-items response as "items", the get-passive-skills response as
+"passive_skills" and optionally "alternate_skill_tree" and an "id". The input is either a directory of such .json
+files or an NDJSON file ("-" for stdin). One JSON line is written to stdout per record
+"""
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import warnings
+from collections.abc import Iterator
+from typing import Optional
+
+import auras
+import stats
+
+def read_records(source: str) -> Iterator[dict]:
+	path = pathlib.Path(source)
+	if path.is_dir():
+		for file in sorted(path.glob('*.json')):
+			with file.open('r', encoding='utf8') as f:
+				record = json.load(f)
+			record.setdefault('id', file.stem)
+			yield record
+		return
+
+	with (sys.stdin if source == '-' else path.open('r', encoding='utf8')) as f:
+		for line_number, line in enumerate(f, 1):
+			if not line.strip():
+				continue
+			record = json.loads(line)
+			record.setdefault('id', line_number)
+			yield record
+
+
+def analyze_record(record: dict, aura_effect: Optional[int]) -> dict:
+	# stdout is reserved for the results
+	with warnings.catch_warnings(record=True) as warning_list, contextlib.redirect_stdout(sys.stderr):
+		try:
+			character = record['items']
+			stats.remove_inactive_items(character)
+			results = auras.analyze_character(character, record['passive_skills'],
+					record.get('alternate_skill_tree', False), aura_effect)
+		except Exception as e:
+			return {'id': record['id'], 'error': f'{e.__class__.__name__}: {e}'}
+	return {'id': record['id'], 'results': results, 'warnings': [str(warning.message) for warning in warning_list]}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('input', help='directory of .json files or NDJSON file, - for stdin')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes (0 for one per core)')
+	parser.add_argument('--aura-effect', type=int, help='override the increased aura effect of every character')
+	args = parser.parse_args()
+
+	records = read_records(args.input)
+	if args.jobs == 1:
+		for record in records:
+			print(json.dumps(analyze_record(record, args.aura_effect)), flush=True)
+		return
+
+	jobs = args.jobs or os.cpu_count() or 1
+	# the data.db connections can't be shared with forked processes
+	context = multiprocessing.get_context('spawn')
+	with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as pool:
+		# keep a bounded number of records in flight so huge inputs aren't read into memory at once
+		in_flight: collections.deque[concurrent.futures.Future] = collections.deque()
+		for record in records:
+			in_flight.append(pool.submit(analyze_record, record, args.aura_effect))
+			if len(in_flight) >= 4 * jobs:
+				print(json.dumps(in_flight.popleft().result()), flush=True)
+		for future in in_flight:
+			print(json.dumps(future.result()), flush=True)
+
+
+if __name__ == '__main__':
+	main()
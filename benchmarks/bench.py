@@ -0,0 +1,203 @@
+"""
+Replays saved characters through every stage of the analysis and reports how long each stage takes
+
+Fixtures use the same format as batch.py: the get-items response as "items", the get-passive-skills response as
+"passive_skills" and "alternate_skill_tree". Record a real character with
+	python -m benchmarks.bench --record account character name
+Hand-built fixtures can set "allocate_jewel_paths" to allocate the shortest path from the class start to every
+socketed jewel in the installed tree, so jewels that depend on the allocation (e.g. Split Personality) stay connected
+"""
+import argparse
+import contextlib
+import copy
+import json
+import pathlib
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import defaultdict, deque
+from collections.abc import Iterator
+
+import auras
+import data
+import gems
+import jewels
+import stats
+
+FIXTURE_DIR = pathlib.Path(__file__).parent / 'fixtures'
+STAGES = [
+	'stats_for_character', 'parse_skills_in_item',
+	'analyze_auras', 'analyze_curses', 'analyze_mines', 'analyze_links',
+]
+
+
+class Recorder:
+	def __init__(self, trace_memory: bool) -> None:
+		self.trace_memory = trace_memory
+		self.times: dict[str, float] = {}
+		self.peak_memory: dict[str, int] = {}
+
+	@contextlib.contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		if self.trace_memory:
+			tracemalloc.reset_peak()
+			start_memory, _ = tracemalloc.get_traced_memory()
+		start = time.perf_counter()
+		yield
+		self.times[name] = time.perf_counter() - start
+		if self.trace_memory:
+			_, peak = tracemalloc.get_traced_memory()
+			self.peak_memory[name] = peak - start_memory
+
+
+def allocate_jewel_paths(fixture: dict) -> None:
+	skills = fixture['passive_skills']
+	tree, _ = stats.passive_skill_tree(fixture.get('alternate_skill_tree', False))
+	start_hash = str(data.tree_index(tree, data.NodeIndex).class_start_nodes[
+			fixture['items']['character']['classId']]['skill'])
+	adjacency_list = data.tree_index(tree, jewels.TreeGraph).adjacency_list
+	allocated = {str(node_hash) for node_hash in skills['hashes']}
+	for jewel in skills['items']:
+		socket_hash = jewels.notable_hashes_for_jewels[jewel['x']]
+		# breadth first search that doesn't pass through other classes' starts, ascendancies or cluster proxies
+		parents: dict[str, str] = {}
+		queue = deque([start_hash])
+		while queue and socket_hash not in parents:
+			current_node = queue.popleft()
+			for next_node in adjacency_list.get(current_node, ()):
+				node = tree['nodes'][next_node]
+				if next_node in parents or next_node == start_hash or node.get('classStartIndex') is not None \
+						or node.get('ascendancyName') or node.get('isProxy'):
+					continue
+				parents[next_node] = current_node
+				queue.append(next_node)
+		if socket_hash not in parents:
+			raise ValueError(f"jewel socket {socket_hash} can't be reached from the class start")
+		node_hash = socket_hash
+		while node_hash != start_hash:
+			allocated.add(node_hash)
+			node_hash = parents[node_hash]
+	skills['hashes'] = sorted(int(node_hash) for node_hash in allocated)
+
+
+def run_fixture(fixture: dict, recorder: Recorder) -> None:
+	character = copy.deepcopy(fixture['items'])
+	skills = copy.deepcopy(fixture['passive_skills'])
+	stats.remove_inactive_items(character)
+	analyzer = auras.Auras()
+	with recorder.stage('stats_for_character'):
+		char_stats, character, skills, alternate_skill_tree = stats.stats_for_character(
+				character, skills, fixture.get('alternate_skill_tree', False))
+	with recorder.stage('parse_skills_in_item'):
+		active_skills = []
+		for item in character['items']:
+			active_skills += gems.parse_skills_in_item(item, char_stats)
+	with recorder.stage('analyze_auras'):
+		analyzer.analyze_auras(char_stats, character, active_skills, skills, alternate_skill_tree)
+	with recorder.stage('analyze_curses'):
+		analyzer.analyze_curses(char_stats, active_skills)
+	with recorder.stage('analyze_mines'):
+		analyzer.analyze_mines(char_stats, active_skills)
+	with recorder.stage('analyze_links'):
+		analyzer.analyze_links(char_stats, active_skills)
+
+
+def benchmark(fixture: dict, repeat: int, warmup: int) -> dict[str, dict[str, float]]:
+	for _ in range(warmup):
+		run_fixture(fixture, Recorder(trace_memory=False))
+
+	times: defaultdict[str, list[float]] = defaultdict(list)
+	for _ in range(repeat):
+		recorder = Recorder(trace_memory=False)
+		run_fixture(fixture, recorder)
+		for name, seconds in recorder.times.items():
+			times[name].append(seconds)
+
+	# allocations are measured in a separate run since tracing them slows everything down
+	recorder = Recorder(trace_memory=True)
+	tracemalloc.start()
+	try:
+		run_fixture(fixture, recorder)
+	finally:
+		tracemalloc.stop()
+
+	return {name: {
+		'median_ms': statistics.median(times[name]) * 1000,
+		'min_ms': min(times[name]) * 1000,
+		'peak_kib': recorder.peak_memory[name] / 1024,
+	} for name in STAGES}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+	regressions = []
+	for fixture_name, fixture_results in results.items():
+		if fixture_name not in baseline:
+			continue
+		for stage, result in fixture_results.items():
+			# stages added since the baseline was saved have nothing to compare against
+			if stage not in baseline[fixture_name]:
+				print(f'{fixture_name} {stage}: not in the baseline')
+				continue
+			old = baseline[fixture_name][stage]['median_ms']
+			# tiny stages are too noisy to compare relatively
+			if result['median_ms'] > old * threshold and result['median_ms'] - old > 0.5:
+				regressions.append(f'{fixture_name} {stage}: {old:.2f}ms -> {result["median_ms"]:.2f}ms')
+	return regressions
+
+
+def record(account: str, character_name: str, name: str) -> None:
+	character, skills, alternate_skill_tree = stats.fetch_character(account, character_name)
+	FIXTURE_DIR.mkdir(exist_ok=True)
+	with (FIXTURE_DIR / f'{name}.json').open('w', encoding='utf8') as f:
+		json.dump({'items': character, 'passive_skills': skills, 'alternate_skill_tree': alternate_skill_tree}, f,
+				indent='\t')
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('fixtures', nargs='*', help='fixture names (default: all)')
+	parser.add_argument('-n', '--repeat', type=int, default=20)
+	parser.add_argument('--warmup', type=int, default=2)
+	parser.add_argument('--save', metavar='BASELINE', help='write the results to this file')
+	parser.add_argument('--compare', metavar='BASELINE', help='exit with 1 if a stage got slower than this baseline')
+	parser.add_argument('--threshold', type=float, default=1.25, help='allowed slowdown when comparing')
+	parser.add_argument('--record', nargs=3, metavar=('ACCOUNT', 'CHARACTER', 'NAME'),
+			help='save a character from pathofexile.com as a fixture')
+	args = parser.parse_args()
+
+	if args.record:
+		record(*args.record)
+		return
+
+	paths = sorted(FIXTURE_DIR.glob('*.json'))
+	if args.fixtures:
+		paths = [path for path in paths if path.stem in args.fixtures]
+	results = {}
+	for path in paths:
+		with path.open('r', encoding='utf8') as f:
+			fixture = json.load(f)
+		if fixture.get('allocate_jewel_paths'):
+			allocate_jewel_paths(fixture)
+		with warnings.catch_warnings(), contextlib.redirect_stdout(sys.stderr):
+			warnings.simplefilter('ignore')
+			results[path.stem] = benchmark(fixture, args.repeat, args.warmup)
+		print(path.stem)
+		for stage, result in results[path.stem].items():
+			print(f'\t{stage:<22}{result["median_ms"]:>9.2f}ms (min {result["min_ms"]:.2f}ms)'
+					f'{result["peak_kib"]:>10.0f}KiB')
+
+	if args.save:
+		with open(args.save, 'w', encoding='utf8') as f:
+			json.dump(results, f, indent='\t')
+	if args.compare:
+		with open(args.compare, 'r', encoding='utf8') as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		if regressions:
+			print('regressions:', *regressions, sep='\n\t')
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
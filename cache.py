@@ -0,0 +1,152 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, Optional, TypeVar
+
+import sqlitedict  # type: ignore
+
+T = TypeVar('T')
+
+class TTLCache:
+	"""
+	LRU cache with at most max_size entries that become stale ttl seconds after they were set
+	Stale entries are still returned (so they can be revalidated) until they are evicted.
+	If path is set, entries are also stored in that sqlite file and loaded again on startup
+	"""
+	def __init__(self, ttl: float, max_size: int, path: Optional[str] = None, table: str = 'cache') -> None:
+		self.ttl = ttl
+		self.max_size = max_size
+		self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+		self.lock = threading.Lock()
+		self.path = path
+		self.table = table
+		self.db: Optional[sqlitedict.SqliteDict] = None
+		if path is not None:
+			self._load(path)
+
+	def _load(self, path: str) -> None:
+		self.db = sqlitedict.SqliteDict(path, tablename=self.table, flag='c', autocommit=True,
+				encode=json.dumps, decode=json.loads)
+		self.entries.clear()
+		for key, (timestamp, value) in sorted(self.db.items(), key=lambda item: item[1][0]):
+			self.entries[key] = (timestamp, value)
+		self._evict()
+
+	def reopen(self, path: Optional[str] = None) -> None:
+		"""
+		Opens a new connection after a fork, since the thread of the old one didn't survive it
+		Pre-forked workers pass a path of their own, since sqlite can't take writes from all of them at once and each
+		of them evicts its own entries
+		"""
+		if path is not None:
+			self.path = path
+		if self.path is not None:
+			with self.lock:
+				self._load(self.path)
+
+	def get(self, key: str) -> tuple[Any, bool]:
+		""" Returns the value (or None) and whether it is still fresh """
+		with self.lock:
+			try:
+				timestamp, value = self.entries[key]
+			except KeyError:
+				return None, False
+			self.entries.move_to_end(key)
+		return value, time.time() - timestamp < self.ttl
+
+	def set(self, key: str, value: Any) -> None:
+		entry = (time.time(), value)
+		with self.lock:
+			self.entries[key] = entry
+			self.entries.move_to_end(key)
+			if self.db is not None:
+				self.db[key] = entry
+			self._evict()
+
+	def _evict(self) -> None:
+		while len(self.entries) > self.max_size:
+			key, _ = self.entries.popitem(last=False)
+			if self.db is not None:
+				del self.db[key]
+
+
+class LRUCache:
+	""" Keeps the max_size most recently used entries and counts hits and misses """
+	def __init__(self, max_size: int) -> None:
+		self.max_size = max_size
+		self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key: Hashable) -> Any:
+		with self.lock:
+			try:
+				value = self.entries[key]
+			except KeyError:
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def set(self, key: Hashable, value: Any) -> None:
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+	def count(self, hits: int, misses: int) -> None:
+		""" Adds lookups of the same cache in another process (e.g. an analysis worker) to the counts """
+		with self.lock:
+			self.hits += hits
+			self.misses += misses
+
+
+class SingleFlight:
+	""" Runs concurrent calls with the same key only once. Every caller gets the result (or exception) of that call """
+	def __init__(self) -> None:
+		self.lock = threading.Lock()
+		self.calls: dict[Hashable, concurrent.futures.Future] = {}
+
+	def do(self, key: Hashable, fn: Callable[..., T], *args: Any) -> T:
+		with self.lock:
+			future = self.calls.get(key)
+			if future is not None:
+				leader = False
+			else:
+				leader = True
+				future = self.calls[key] = concurrent.futures.Future()
+		if not leader:
+			return future.result()
+
+		try:
+			result = fn(*args)
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		else:
+			future.set_result(result)
+			return result
+		finally:
+			with self.lock:
+				del self.calls[key]
+
+
+class AsyncSingleFlight:
+	""" SingleFlight for coroutines on one event loop """
+	def __init__(self) -> None:
+		self.calls: dict[Hashable, asyncio.Future] = {}
+
+	async def do(self, key: Hashable, fn: Callable[..., Awaitable[T]], *args: Any) -> T:
+		future = self.calls.get(key)
+		if future is None:
+			# a separate task, so a caller that is cancelled (its client went away) doesn't cancel it for the others
+			future = self.calls[key] = asyncio.ensure_future(fn(*args))
+			future.add_done_callback(lambda _: self.calls.pop(key))
+		return await asyncio.shield(future)
@@ -0,0 +1,35 @@
+""" Settings that can be overridden with environment variables (e.g. fly secrets) """
+import os
+
+# only keep this many decoded records per gem data table in memory (unbounded if not set)
+gem_cache_size = int(os.environ['POECALC_GEM_CACHE_SIZE']) if os.environ.get('POECALC_GEM_CACHE_SIZE') else None
+
+# seconds until responses from pathofexile.com are revalidated
+upstream_cache_ttl = int(os.environ.get('POECALC_UPSTREAM_CACHE_TTL', 60))
+upstream_cache_size = int(os.environ.get('POECALC_UPSTREAM_CACHE_SIZE', 1000))
+# sqlite file to persist the upstream cache to, so it survives restarts. pre-forked workers each use <path>.<n>
+# instead, asgi.py only persists it with one worker
+upstream_cache_path = os.environ.get('POECALC_UPSTREAM_CACHE_PATH')
+
+# number of rendered analyses to keep, keyed on the character data they were computed from
+result_cache_size = int(os.environ.get('POECALC_RESULT_CACHE_SIZE', 500))
+# number of translated effect lines of gems to keep, keyed on everything the lines depend on
+gem_effect_cache_size = int(os.environ.get('POECALC_GEM_EFFECT_CACHE_SIZE', 10000))
+
+# add a Server-Timing header with the time spent in each stage to responses
+server_timing = os.environ.get('POECALC_SERVER_TIMING', '') not in ('', '0')
+
+# requests to /auras/... with ?profile=<this secret> are run under cProfile (disabled if not set)
+profile_secret = os.environ.get('POECALC_PROFILE_SECRET')
+
+# number of pre-forked server processes sharing the listening socket (0 for one per core)
+workers = int(os.environ.get('POECALC_WORKERS', 1))
+
+# processes that analyses run in so they don't block the server (0 to analyze in the server process)
+analysis_workers = int(os.environ.get('POECALC_ANALYSIS_WORKERS', 0))
+# analyses that may wait for one of those processes before requests are turned away with a 503
+analysis_queue_depth = int(os.environ.get('POECALC_ANALYSIS_QUEUE_DEPTH', 16))
+
+# characters a bulk request (POST /api/auras) may contain, and how many of them are fetched and analyzed at once
+bulk_max_characters = int(os.environ.get('POECALC_BULK_MAX_CHARACTERS', 100))
+bulk_concurrency = int(os.environ.get('POECALC_BULK_CONCURRENCY', 4))
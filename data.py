@@ -1,13 +1,27 @@
+import array
+import dataclasses
+import functools
 import io
 import json
 import math
+import os
 import re
+import sqlite3
+import types
 import warnings
 import zipfile
+import zlib
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
 from enum import Enum
+from typing import TYPE_CHECKING, Any, Optional, TypeVar, Union
 
 import sqlitedict  # type: ignore
 
+if TYPE_CHECKING:
+	import numpy as np
+
+import config
+
 def prepare_data() -> None:
 	with open('data/gems.json', 'rb') as f:
 		raw_gems: dict[str, dict] = json.load(f)
@@ -29,7 +43,7 @@ def prepare_data() -> None:
 			for k in translation['ids']:
 				translated = translation['English'][0]
 				if any(translated['string'].startswith(prefix + ' ') for prefix in prefixes):
-					aura_translation[k] = translation['English']
+					aura_translation[k] = compile_translations(translation['English'])
 
 		with open('data/buff_skill.json', 'rb') as f:
 			raw_text = json.load(f)
@@ -38,7 +52,7 @@ def prepare_data() -> None:
 			for k in translation['ids']:
 				translated = translation['English'][0]
 				if any(substring.lower() in translated['string'].lower() for substring in substrings):
-					aura_translation[k] = translation['English']
+					aura_translation[k] = compile_translations(translation['English'])
 
 		aura_translation.commit()
 
@@ -50,21 +64,403 @@ def prepare_data() -> None:
 			for k in translation['ids']:
 				translated = translation['English'][0]
 				if any(identifier in translated['string'].lower() for identifier in identifiers):
-					curse_translation[k] = translation['English']
+					curse_translation[k] = compile_translations(translation['English'])
 		curse_translation.commit()
 
-def load() -> tuple[dict[str, dict], dict, dict]:
-	gems = _sqlite_dict('gems', 'r')
-	aura_translation = _sqlite_dict('aura_translation', 'r')
-	curse_translation = _sqlite_dict('curse_translation', 'r')
+	prepare_legion_passives()
+	prepare_timeless_jewels()
+
+INDEX_HANDLER_DIVISORS = {
+	'per_minute_to_per_second': 60,
+	'milliseconds_to_seconds_2dp': 1000,
+	'divide_by_one_hundred': 100,
+	'per_minute_to_per_second_2dp': 30,
+}
+
+def compile_translations(translations: list[dict]) -> list[dict]:
+	"""
+	Turns the RePoE translations of a stat into rules that don't have to be interpreted for every gem: the value range
+	of the condition, the index handlers as a divisor and a sign, and the lines the aura, curse, mine and link analyses
+	make of the string
+	"""
+	rules = []
+	for translation in translations:
+		condition = translation['condition'][0]
+		divisor = 1
+		negate = False
+		unhandled_index_handler = None
+		for handler in translation['index_handlers'][0]:
+			if handler == 'negate':
+				negate = not negate
+			elif handler in INDEX_HANDLER_DIVISORS:
+				divisor *= INDEX_HANDLER_DIVISORS[handler]
+			elif unhandled_index_handler is None:
+				# only an error if a gem actually has this stat
+				unhandled_index_handler = handler
+		plus_signs = [fmt == '+#' for fmt in translation['format']]
+		# the other analyses match the text around the values and keep their signs, so they start from the line with the
+		# signs filled in and {0}, {1}... for the values
+		signed = re.sub(r'\{(\d+)\}', lambda m: ('+' if plus_signs[int(m.group(1))] else '') + m.group(0),
+				translation['string'])
+		mine = _mine_line(signed)
+		link = _link_line(signed)
+		rules.append({
+			'min': condition.get('min'),
+			'max': condition.get('max'),
+			'string': translation['string'],
+			'aura': _aura_line(translation['string']),
+			'curse': _curse_lines(signed),
+			'mine': mine[0] if mine else None,
+			'mine_caps': mine[1] if mine else [],
+			'link': link[0] if link else None,
+			'link_life_percent': link[1] if link else None,
+			'plus_signs': plus_signs,
+			'divisor': divisor,
+			'negate': negate,
+			'unhandled_index_handler': unhandled_index_handler,
+		})
+	return rules
+
+def _aura_line(string: str) -> Optional[str]:
+	"""
+	Rewrites a translation string the way the aura analysis needs it, before the values are formatted in.
+	Returns '' for lines that are skipped and None for lines that can't be rewritten
+	"""
+	if m := re.search('you and nearby allies( deal| have| gain| are|) (.*)', string, re.IGNORECASE):
+		return m.group(2)
+	if m := re.search("nearby allies' (.*)", string, re.IGNORECASE):
+		return f'Your {m.group(1)}'
+	if string.startswith(('Aura grants ', 'Buff grants ')):
+		return string[len('Aura grants '):]
+	if string.startswith('You and nearby Non-Minion Allies have a '):
+		return ''
+	return None
+
+def _value_pattern(pattern: str) -> str:
+	""" A regex for a signed translation string, with # matching (and capturing) the placeholder of a value """
+	return pattern.replace('#', r'(\{\d+\})')
+
+def _value_index(placeholder: str) -> int:
+	return int(placeholder[1:-1])
+
+def _curse_lines(signed: str) -> Optional[list[str]]:
+	""" The lines the curse analysis makes of a signed translation string, None for lines it doesn't handle """
+	if m := re.search(_value_pattern('Other effects on Cursed enemies expire #% slower'), signed):
+		# ailments are a subsection of "effects", but the only ones that matter
+		# this would be inaccurate if there are other "more ailment duration" mods, but they are nonexistent
+		return [f'{m.group(1)}% more Duration of Ailments']
+	if 'Cursed Enemies are Debilitated' in signed:
+		# debilitate is not recognised by pob
+		return ['Nearby Enemies deal 10% less damage', 'Nearby Enemies have 20% less movement speed.']
+	if 'to Hits against Cursed Enemies' in signed:
+		return [signed.replace('against Cursed Enemies', '')]
+	if m := re.search(_value_pattern('Cursed enemies grant # (Life|Mana) when Hit by (Attacks|Spells)'), signed):
+		return [f'+{m.group(1)} {m.group(2)} gained for each Enemy hit by your {m.group(3)}']
+	if m := re.search(r'Cursed Enemies grant (.*)% (Life|Mana) Leech when Hit by (Attack|Spell)s', signed,
+			re.IGNORECASE):
+		return [f'{m.group(1)}% of {m.group(3)} Damage leeched as {m.group(2)}']
+	if m := re.search(_value_pattern('Cursed enemies grant # (Life|Mana) when Killed'), signed):
+		return [f'+{m.group(1)} {m.group(2)} gained on kill']
+	if m := re.search('Hits (against|on) Cursed Enemies have (.*)', signed):
+		return [m.group(2)]
+	if m := re.search('Ailments inflicted on Cursed Enemies (.*)', signed):
+		return [f'Damaging Ailments {m.group(1)}']
+	if m := re.search(_value_pattern('Cursed enemies take #% increased Damage from Damage over Time effects'), signed):
+		return [f'Nearby Enemies have {m.group(1)}% increased Damage over Time taken']
+	if m := re.search(_value_pattern('Cursed enemies take #% increased Damage from Projectile Hits'), signed):
+		return [f'Nearby Enemies take {m.group(1)}% increased Projectile Damage']
+	if m := re.search(_value_pattern('(Ignite|Freeze|Shock)(|s) on Cursed enemies (have|has) #% increased Duration'),
+			signed):
+		return [f'{m.group(4)}% increased {m.group(1)} Duration on Enemies']
+	if 'increased Duration of Elemental Ailments on Cursed enemies' in signed:
+		return [signed.replace('on cursed Enemies', '')]
+	if m := re.search(_value_pattern('Hits have #% chance to (.*) Cursed Enemies'), signed):
+		return [f'{m.group(1)}% Chance to {m.group(2)} Enemies on Hit']
+	if any(substr in signed.lower() for substr in ['split', 'charge', 'overkill']):
+		# not recognised by pob at all
+		return []
+	if m := re.search('^Cursed(.*)Enemies (.*)', signed, re.IGNORECASE):
+		return [f'Nearby Enemies {m.group(2)}']
+	return None
+
+def _mine_line(signed: str) -> Optional[tuple[str, list[tuple[int, int]]]]:
+	"""
+	The line the mine analysis makes of a signed translation string and the values it caps. Value i of the line is value
+	caps[i][0] of the string times the mine limit, up to value caps[i][1]
+	"""
+	if m := re.search(_value_pattern('Each Mine applies #% increased Damage Taken to Enemies near it, up\nto a maximum '
+			'of #%'), signed):
+		return 'Nearby Enemies take {0}% increased damage', [(_value_index(m.group(1)), _value_index(m.group(2)))]
+	if m := re.search(_value_pattern('Each Mine applies #% chance to deal Double Damage to Hits against Enemies '
+			'near it, up to a maximum of #%'), signed):
+		return '{0}% chance to deal double Damage', [(_value_index(m.group(1)), _value_index(m.group(2)))]
+	if m := re.search(_value_pattern('Each Mine applies #% increased Critical Strike Chance to Hits against Enemies '
+			'near it, up to a maximum of #%'), signed):
+		return '{0}% increased Critical Strike Chance', [(_value_index(m.group(1)), _value_index(m.group(2)))]
+	if m := re.search(_value_pattern('Each Mine Adds # to # Fire Damage to Hits against Enemies near it, up to a '
+			'maximum of # to #'), signed):
+		return '{0} to {1} added Fire Damage', [
+			(_value_index(m.group(1)), _value_index(m.group(3))),
+			(_value_index(m.group(2)), _value_index(m.group(4))),
+		]
+	return None
+
+def _link_line(signed: str) -> Optional[tuple[str, Optional[int]]]:
+	"""
+	The line the link analysis makes of a signed translation string. If the second value isn't None, the line only has
+	the added damage from that value as a percentage of the character's life
+	"""
+	if m := re.search(_value_pattern('#% of Damage from Hits against target is taken'), signed):
+		return f'{m.group(1)}% less damage taken from Hits', None
+	if m := re.search(_value_pattern('Linked target takes #% less Damage'), signed):
+		return f'{m.group(1)}% less damage taken', None
+	if m := re.search(_value_pattern('Linked target gains Added Fire Damage equal to #% of your'), signed):
+		return '{0} to {0} Added Fire Damage', _value_index(m.group(1))
+	if m := re.search(_value_pattern('Linked target Recovers # Life when they Block'), signed):
+		return f'Recover {m.group(1)} Life when you Block', None
+	if m := re.search('Linked target (has|deals|gains) (.*)', signed):
+		return m.group(2), None
+	return None
+
+@functools.cache
+def version() -> str:
+	""" Identifies the data files this process uses. Only changes when the data is prepared again """
+	files = ['data.db', 'data/skill_tree.json', 'data/skill_tree_alternate.json']
+	return ','.join(f'{stat.st_size}:{stat.st_mtime_ns}' for stat in (os.stat(file) for file in files))
+
+def load() -> tuple['GemTable', 'TranslationTable', 'TranslationTable']:
+	gems = GemTable('gems', config.gem_cache_size)
+	aura_translation = TranslationTable('aura_translation', config.gem_cache_size)
+	curse_translation = TranslationTable('curse_translation', config.gem_cache_size)
 	return gems, aura_translation, curse_translation
 
+class GemTable(Mapping[str, Any]):
+	"""
+	Read-only view of a data.db table that decodes each record once and keeps it in memory
+	Records are shared by all requests, so they are frozen: dicts become mappingproxies and lists become tuples
+	The table is only opened on first use
+	"""
+	def __init__(self, table: str, cache_size: Optional[int] = None) -> None:
+		self.table = table
+		self.get_record = functools.lru_cache(maxsize=cache_size)(self._decode_record)
+		self.level_stats = functools.lru_cache(maxsize=cache_size)(self._level_stats)
+
+	@functools.cached_property
+	def db(self) -> sqlitedict.SqliteDict:
+		return _sqlite_dict(self.table, 'r')
+
+	@functools.cached_property
+	def keys_in_order(self) -> tuple[str, ...]:
+		return tuple(self.db.keys())
+
+	@functools.cached_property
+	def key_set(self) -> frozenset[str]:
+		return frozenset(self.keys_in_order)
+
+	def reopen(self) -> None:
+		""" Drops the connection (e.g. after a fork, which its thread doesn't survive) so the next lookup opens one """
+		self.__dict__.pop('db', None)
+
+	def _decode_record(self, key: str) -> Any:
+		return _freeze(self.db[key])
+
+	def _level_stats(self, gem_name: str, level: int) -> tuple[tuple[str, Any], ...]:
+		""" (stat id, value) pairs of a gem at the given level """
+		gem_data = self[gem_name]
+		level_stats = []
+		for stat, value in zip(gem_data['static']['stats'], gem_data['per_level'][str(level)]['stats'] or []):
+			# catching some weird corrupted data (rage support)
+			if stat is None:
+				continue
+			if value is None:
+				value = stat.get('value')
+			else:
+				value = value.get('value')
+			level_stats.append((stat['id'], value))
+		return tuple(level_stats)
+
+	def __getitem__(self, key: str) -> Any:
+		if key not in self.key_set:
+			raise KeyError(key)
+		return self.get_record(key)
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.keys_in_order)
+
+	def __len__(self) -> int:
+		return len(self.keys_in_order)
+
+	def __contains__(self, key: object) -> bool:
+		return key in self.key_set
+
+@dataclasses.dataclass(frozen=True)
+class TranslationRule:
+	""" Translation of a stat for values between min and max, see compile_translations """
+	min: float
+	max: float
+	string: str
+	aura: Optional[str]
+	# the lines of the other analyses have the signs in them already, so they are formatted with the values as they are
+	curse: Optional[tuple[str, ...]]
+	mine: Optional[str]
+	mine_caps: tuple[tuple[int, int], ...]
+	link: Optional[str]
+	link_life_percent: Optional[int]
+	plus_signs: tuple[bool, ...]
+	divisor: int
+	negate: bool
+	unhandled_index_handler: Optional[str]
+
+	@classmethod
+	def from_record(cls, rule: dict) -> 'TranslationRule':
+		return cls(
+			min=-math.inf if rule['min'] is None else rule['min'],
+			max=math.inf if rule['max'] is None else rule['max'],
+			string=rule['string'],
+			aura=rule['aura'],
+			curse=None if rule['curse'] is None else tuple(rule['curse']),
+			mine=rule['mine'],
+			mine_caps=tuple((value, cap) for value, cap in rule['mine_caps']),
+			link=rule['link'],
+			link_life_percent=rule['link_life_percent'],
+			plus_signs=tuple(rule['plus_signs']),
+			divisor=rule['divisor'],
+			negate=rule['negate'],
+			unhandled_index_handler=rule['unhandled_index_handler'],
+		)
+
+	def scale(self, value: float, factor: float) -> Union[int, float]:
+		if self.unhandled_index_handler is not None:
+			raise Exception('unhandled index_handler: ' + self.unhandled_index_handler)
+		scaled = float(value)
+		if self.divisor != 1:
+			scaled /= self.divisor
+		if self.negate:
+			scaled *= -1
+		scaled *= 1 + factor / 100
+		if self.divisor != 1:
+			return round(scaled, 1)
+		return int(scaled)
+
+	def render(self, template: str, values: Sequence[Union[float, str]]) -> str:
+		return template.format(*(f'+{value}' if plus_sign else value
+				for plus_sign, value in zip(self.plus_signs, values)))
+
+class TranslationTable(GemTable):
+	""" The translation rules of every stat, see compile_translations. The first rule whose range has the value wins """
+	def _decode_record(self, key: str) -> tuple[TranslationRule, ...]:
+		return tuple(TranslationRule.from_record(rule) for rule in self.db[key])
+
+def _freeze(obj: Any) -> Any:
+	if isinstance(obj, dict):
+		return types.MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+	if isinstance(obj, list):
+		return tuple(_freeze(v) for v in obj)
+	return obj
+
 def _sqlite_dict(table: str, flag: str) -> sqlitedict.SqliteDict:
 	return sqlitedict.SqliteDict('data.db', tablename=table, flag=flag,
 			journal_mode='OFF', encode=json.dumps, decode=json.loads)
 
-def legion_passive_mapping() -> dict:
-	""" Maps names of timeless legion passives to their effects """
+@functools.cache
+def passive_skill_tree(alternate_skill_tree: bool) -> tuple[dict, dict]:
+	""" Parses the passive tree and its mastery effects once per process. Callers must not modify the result """
+	path = 'data/skill_tree_alternate.json' if alternate_skill_tree else 'data/skill_tree.json'
+	print('using skill tree', path)
+	with open(path, 'r', encoding='utf8') as file:
+		tree_dict = json.load(file)
+
+	masteries_dict = {}
+	for node in tree_dict['nodes'].values():
+		if 'masteryEffects' not in node:
+			continue
+		for effect in node['masteryEffects']:
+			masteries_dict[effect['effect']] = {'name': node['name'], 'stats': effect['stats']}
+	return tree_dict, masteries_dict
+
+
+class PassiveNodes(Mapping[str, dict]):
+	"""
+	Copy-on-write view of the shared passive tree nodes for a single request
+	Nodes are copied (including their stats list) the first time they are looked up by hash, so jewels can rewrite
+	them without affecting other requests. Iterating only yields read-only nodes and must not be used for mutation
+	"""
+	def __init__(self, base: dict[str, dict]) -> None:
+		self.base = base
+		self.overlay: dict[str, dict] = {}
+
+	def __getitem__(self, node_hash: str) -> dict:
+		try:
+			return self.overlay[node_hash]
+		except KeyError:
+			pass
+		node = dict(self.base[node_hash])
+		if 'stats' in node:
+			node['stats'] = list(node['stats'])
+		self.overlay[node_hash] = node
+		return node
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.base)
+
+	def __len__(self) -> int:
+		return len(self.base)
+
+	def __contains__(self, node_hash: object) -> bool:
+		return node_hash in self.base
+
+	def items(self) -> Iterator[tuple[str, dict]]:  # type: ignore[override]
+		for node_hash, node in self.base.items():
+			yield node_hash, self.overlay.get(node_hash, node)
+
+	def values(self) -> Iterator[dict]:  # type: ignore[override]
+		for node_hash, node in self.base.items():
+			yield self.overlay.get(node_hash, node)
+
+
+T = TypeVar('T')
+_tree_indexes: dict[tuple[int, Callable], Any] = {}
+
+def tree_index(tree: dict, build: Callable[[dict], T]) -> T:
+	"""
+	Returns build(tree), which is only computed once per process for cached trees
+	build must only depend on the static tree, since it doesn't see the nodes modified by the current request
+	"""
+	nodes = tree['nodes']
+	if not isinstance(nodes, PassiveNodes):
+		return build(tree)
+	# cached trees are never freed, so their id can't be reused by another tree
+	key = (id(nodes.base), build)
+	try:
+		return _tree_indexes[key]
+	except KeyError:
+		index = _tree_indexes[key] = build({**tree, 'nodes': nodes.base})
+		return index
+
+
+class NodeIndex:
+	""" Finds passives of a static tree by name and the starting node of every class without scanning all nodes """
+	def __init__(self, tree: dict) -> None:
+		self.hash_for_name: dict[str, str] = {}
+		self.class_start_nodes: dict[int, dict] = {}
+		ranks: dict[str, tuple[bool, bool]] = {}
+		for node_hash, node in tree['nodes'].items():
+			if node_hash == 'root':
+				continue
+			if node.get('classStartIndex') is not None:
+				self.class_start_nodes.setdefault(node['classStartIndex'], node)
+			# some names are used more than once. "Allocates" mods refer to notables, so those win over small
+			# passives and the sockets of the cluster jewel subgraph. otherwise the first node wins, like a scan would
+			rank = (not (node.get('isNotable') or node.get('isKeystone')),
+					bool(node.get('isProxy')) or 'expansionJewel' in node)
+			name = node['name']
+			if name not in ranks or rank < ranks[name]:
+				ranks[name] = rank
+				self.hash_for_name[name] = node_hash
+
+
+def prepare_legion_passives() -> None:
+	""" Converts the effects of timeless legion passives from lua once so they don't have to be parsed on startup """
 	# I couldn't find any of this info in the RePoE data, so I'm grabbing it from the path of building repo
 	with open('data/LegionPassives.lua', 'r', encoding='utf8') as file:
 		content = file.read()
@@ -72,7 +468,17 @@ def legion_passive_mapping() -> dict:
 		content = re.sub(r',\s+}', r'}', content)  # removes commas after the last key value pairs
 		content = re.sub(r'\[(.*)\] =', r'\1:', content)  # removes brackets around keys and changes " =" to ":"
 		content_dict = json.loads(content[content.find('{'):])
-		return {node['dn']: node['sd'].values() for node in content_dict['nodes'].values()}
+	with _sqlite_dict('legion_passives', 'w') as legion_passives:
+		legion_passives.clear()
+		for node in content_dict['nodes'].values():
+			legion_passives[node['dn']] = list(node['sd'].values())
+		legion_passives.commit()
+
+@functools.cache
+def legion_passive_mapping() -> dict[str, tuple[str, ...]]:
+	""" Maps names of timeless legion passives to their effects, as prepared by prepare_legion_passives """
+	with _sqlite_dict('legion_passives', 'r') as legion_passives:
+		return {name: tuple(effects) for name, effects in legion_passives.items()}
 
 
 class TimelessJewelType(Enum):
@@ -83,64 +489,177 @@ class TimelessJewelType(Enum):
 	ELEGANT_HUBRIS = 'elegant_hubris'
 
 
-def timeless_node_mapping(seed: int, jewel_type: TimelessJewelType) -> dict:
-	with zipfile.ZipFile(f'data/TimelessJewels/{jewel_type.value}.zip') as archive:
-		with archive.open(f'{seed}.csv', 'r') as infile:
-			alt_passives = [
-				line.split(',') for line in io.TextIOWrapper(infile, 'utf-8').read().split('\n')
-			]
-
-	with open(f'data/TimelessJewels/{jewel_type.value}_passives.txt', 'r', encoding='utf8') as file:
-		passives = [int(line) for line in file.read().split('\n') if line != '']
+def prepare_timeless_jewels() -> None:
+	""" Resolves the alternate passives of every seed of every timeless jewel into translated mods """
+	# numpy is only imported where timeless jewels are searched, so importing this module stays cheap
+	import numpy as np
 
 	with open('data/TimelessJewels/stats.txt', 'r', encoding='utf8') as file:
 		stats = [line for line in file.read().split('\n') if line != '']
 
-	list_of_stats = set()
-	mapping: dict[int, dict] = {}
-	for p, ap in zip(passives, alt_passives):
-		if ap == ['']:
-			continue
-		mods = []
-		for i in range(1, len(ap), 2):
-			list_of_stats.add(stats[int(ap[i])])
-			mods.append((stats[int(ap[i])], int(ap[i + 1])))
-		mapping[p] = {'replaced': bool(int(ap[0])), 'mods': mods}
-
 	with open('data/passive_skill.json', 'r', encoding='utf8') as file:
-		data = json.loads(file.read())
-		stat_map = {}
-		for stat in list_of_stats:
-			for skill in data:
-				if stat in skill['ids']:
-					stat_map[stat] = skill['English']
-					break
-
-	for alt_passive in mapping.values():
-		resolved_mods = []
-		for mod in alt_passive['mods']:
-			if mod[0] not in stat_map:
-				# not sure whats the problem here, but these mods dont seem to matter anyway
-				continue
-			for translation in stat_map[mod[0]]:
-				condition = translation['condition'][0]
-				if condition == {}:
-					break
-				max = math.inf if condition['max'] is None else condition['max']
-				min = -math.inf if condition['min'] is None else condition['min']
-				if max >= mod[1] >= min:
-					break
-			else:
-				warnings.warn(f'Could not resolve mod {mod}')
-				continue
-			form = translation['format'][0]
-			if form == 'ignore':
-				resolved_mods.append(translation['string'])
-			else:
-				resolved_mods.append(translation['string'].format(form.replace('#', str(mod[1]))))
-		alt_passive['mods'] = resolved_mods
+		translations: dict[str, list[dict]] = {}
+		for skill in json.load(file):
+			for stat_id in skill['ids']:
+				translations.setdefault(stat_id, skill['English'])
+	stat_map = {stat: translations[stat] for stat in stats if stat in translations}
+
+	with _timeless_jewel_dict('w') as timeless_jewels, _timeless_column_dict('w') as timeless_columns:
+		# the tables share data.db, so each has to commit before the other one can write
+		timeless_jewels.clear()
+		timeless_jewels.commit()
+		timeless_columns.clear()
+		timeless_columns['stats'] = {'stats': np.array(stats)}
+		timeless_columns.commit()
+		for jewel_type in TimelessJewelType:
+			with open(f'data/TimelessJewels/{jewel_type.value}_passives.txt', 'r', encoding='utf8') as file:
+				passives = [int(line) for line in file.read().split('\n') if line != '']
+
+			# the same mods as columns per passive to search all seeds at once, see timeless_seed_columns. some jewel
+			# types have tens of millions of them, so they are collected in compact arrays instead of lists of ints
+			seeds = []
+			passive_indexes, seed_indexes = array.array('H'), array.array('H')
+			stat_indexes, values = array.array('h'), array.array('h')
+			with zipfile.ZipFile(f'data/TimelessJewels/{jewel_type.value}.zip') as archive:
+				filenames = sorted((filename for filename in archive.namelist() if filename.endswith('.csv')),
+						key=lambda filename: int(filename[:-len('.csv')]))
+				for seed_index, filename in enumerate(filenames):
+					seed = int(filename[:-len('.csv')])
+					seeds.append(seed)
+					with archive.open(filename, 'r') as infile:
+						alt_passives = [
+							line.split(',') for line in io.TextIOWrapper(infile, 'utf-8').read().split('\n')
+						]
+					mapping = {}
+					for passive_index, (p, ap) in enumerate(zip(passives, alt_passives)):
+						if ap == ['']:
+							continue
+						mods = []
+						for i in range(1, len(ap), 2):
+							mod = _translate_timeless_mod(stats[int(ap[i])], int(ap[i + 1]), stat_map)
+							if mod is not None:
+								mods.append(mod)
+							passive_indexes.append(passive_index)
+							seed_indexes.append(seed_index)
+							stat_indexes.append(int(ap[i]))
+							values.append(int(ap[i + 1]))
+						mapping[p] = {'replaced': bool(int(ap[0])), 'mods': mods}
+					timeless_jewels[_timeless_jewel_key(jewel_type, seed)] = mapping
+			timeless_jewels.commit()
+
+			timeless_columns[f'{jewel_type.value}/seeds'] = {'seeds': np.array(seeds, dtype=np.int32)}
+			# the mods were read seed by seed, a stable sort groups them by passive and keeps them ordered by seed
+			order = np.argsort(np.frombuffer(passive_indexes, dtype=np.uint16), kind='stable')
+			bounds = np.searchsorted(np.frombuffer(passive_indexes, dtype=np.uint16)[order], range(len(passives) + 1))
+			seed_column = np.frombuffer(seed_indexes, dtype=np.uint16)[order]
+			stat_column = np.frombuffer(stat_indexes, dtype=np.int16)[order]
+			value_column = np.frombuffer(values, dtype=np.int16)[order]
+			del passive_indexes, seed_indexes, stat_indexes, values, order
+			for passive_index, p in enumerate(passives):
+				rows = slice(bounds[passive_index], bounds[passive_index + 1])
+				timeless_columns[_timeless_column_key(jewel_type, p)] = {
+					'seed_index': seed_column[rows],
+					'stat': stat_column[rows],
+					'value': value_column[rows],
+				}
+			timeless_columns.commit()
+
+def _translate_timeless_mod(stat: str, value: int, stat_map: dict[str, list[dict]]) -> Optional[str]:
+	if stat not in stat_map:
+		# not sure whats the problem here, but these mods dont seem to matter anyway
+		return None
+	for translation in stat_map[stat]:
+		condition = translation['condition'][0]
+		if condition == {}:
+			break
+		max = math.inf if condition['max'] is None else condition['max']
+		min = -math.inf if condition['min'] is None else condition['min']
+		if max >= value >= min:
+			break
+	else:
+		warnings.warn(f'Could not resolve mod {(stat, value)}')
+		return None
+	form = translation['format'][0]
+	if form == 'ignore':
+		return translation['string']
+	return translation['string'].format(form.replace('#', str(value)))
+
+def _timeless_jewel_dict(flag: str) -> sqlitedict.SqliteDict:
+	# there are tens of thousands of seeds with a mapping for every passive in radius, so these are compressed
+	return sqlitedict.SqliteDict('data.db', tablename='timeless_jewels', flag=flag, journal_mode='OFF',
+			encode=lambda obj: sqlite3.Binary(zlib.compress(json.dumps(obj).encode('utf-8'))),
+			decode=lambda blob: json.loads(zlib.decompress(blob)))
+
+def _timeless_jewel_key(jewel_type: TimelessJewelType, seed: int) -> str:
+	return f'{jewel_type.value}/{seed}'
+
+@functools.cache
+def _timeless_jewels() -> sqlitedict.SqliteDict:
+	return _timeless_jewel_dict('r')
+
+def _timeless_column_dict(flag: str) -> sqlitedict.SqliteDict:
+	return sqlitedict.SqliteDict('data.db', tablename='timeless_columns', flag=flag, journal_mode='OFF',
+			encode=_encode_arrays, decode=_decode_arrays)
+
+def _encode_arrays(arrays: dict[str, 'np.ndarray']) -> sqlite3.Binary:
+	import numpy as np
+	buffer = io.BytesIO()
+	np.savez_compressed(buffer, **arrays)  # type: ignore[arg-type]  # stubs mix up the array names with allow_pickle
+	return sqlite3.Binary(buffer.getvalue())
+
+def _decode_arrays(blob: bytes) -> dict[str, 'np.ndarray']:
+	import numpy as np
+	with np.load(io.BytesIO(blob)) as arrays:
+		return dict(arrays)
+
+def _timeless_column_key(jewel_type: TimelessJewelType, passive: int) -> str:
+	return f'{jewel_type.value}/passives/{passive}'
+
+@functools.cache
+def _timeless_columns() -> sqlitedict.SqliteDict:
+	return _timeless_column_dict('r')
+
+def reopen() -> None:
+	""" Makes a forked process open its own connections to data.db """
+	_timeless_jewels.cache_clear()
+	_timeless_columns.cache_clear()
+
+def timeless_node_mapping(seed: int, jewel_type: TimelessJewelType) -> dict[int, dict]:
+	""" Maps passive hashes to their alternate mods for a timeless jewel, as prepared by prepare_timeless_jewels """
+	mapping = _timeless_jewels()[_timeless_jewel_key(jewel_type, seed)]
+	return {int(passive): alt_passive for passive, alt_passive in mapping.items()}
+
+@dataclasses.dataclass(frozen=True)
+class TimelessSeedColumns:
+	"""
+	The alternate mods of some passives for every seed of a timeless jewel, one row per mod:
+	row i gives timeless_stats()[stat[i]] with value[i] to one of the passives on seed seeds[seed_index[i]]
+	"""
+	seeds: 'np.ndarray'
+	seed_index: 'np.ndarray'
+	stat: 'np.ndarray'
+	value: 'np.ndarray'
+
+@functools.cache
+def timeless_stats() -> tuple[str, ...]:
+	""" The stat ids of timeless jewel mods, in the order TimelessSeedColumns.stat refers to them """
+	return tuple(_timeless_columns()['stats']['stats'].tolist())
+
+def timeless_seed_columns(jewel_type: TimelessJewelType, passives: Iterable[int]) -> TimelessSeedColumns:
+	""" The alternate mods of passives for every seed, as prepared by prepare_timeless_jewels """
+	import numpy as np
 
-	return mapping
+	columns = _timeless_columns()
+	seeds = columns[f'{jewel_type.value}/seeds']['seeds']
+	passive_columns = []
+	for passive in passives:
+		key = _timeless_column_key(jewel_type, passive)
+		# passives a timeless jewel can't change aren't prepared
+		if key in columns:
+			passive_columns.append(columns[key])
+	def concatenate(name: str) -> 'np.ndarray':
+		return np.concatenate([column[name] for column in passive_columns] or [np.zeros(0, dtype=np.int32)])
+	return TimelessSeedColumns(seeds, concatenate('seed_index'), concatenate('stat'), concatenate('value'))
 
 if __name__ == '__main__':
 	prepare_data()
@@ -1,16 +1,29 @@
-import math
 import re
 import warnings
+from collections.abc import Callable, Iterable, Mapping
 from copy import copy
 from enum import Enum
-from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple, Union
 
 if TYPE_CHECKING:
 	from stats import Stats
 
+import cache
+import config
 import data
+import metrics
 
+# the tables are opened on first use, so importing this is cheap
 all_gems, aura_translation, curse_translation = data.load()
+# popular builds use the same gems with the same supports, so their translated lines are shared between characters
+effect_lines = cache.LRUCache(config.gem_effect_cache_size)
+
+
+class Result(List[str]):
+	""" Lines of one analysis result, the first being a // comment. source describes what they come from """
+	def __init__(self, lines: Iterable[str], source: dict[str, Any]) -> None:
+		super().__init__(lines)
+		self.source = source
 
 
 class GemQualityType(Enum):
@@ -66,25 +79,18 @@ class Gem:
 				self.quality += quality
 
 	def iterate_effects(self, get_vaal_effect: bool = True) -> list[tuple[str, int]]:
-		effects = []
-		gem_data = self.get_gem_data(get_vaal_effect)
-		for stat, value in zip(gem_data['static']['stats'], gem_data['per_level'][str(self.level)]['stats'] or []):
-			# catching some weird corrupted data (rage support)
-			if stat is None:
-				continue
-			if value is None:
-				value = stat.get('value')
-			else:
-				value = value.get('value')
-			effects.append((stat['id'], value))
+		effects = list(all_gems.level_stats(self.gem_data_name(get_vaal_effect), self.level))
 		effects.extend(self.quality_effect(get_vaal_effect))
 		effects.extend(self.additional_effects)
 		return effects
 
-	def get_gem_data(self, get_vaal_effect: bool = True) -> dict:
+	def get_gem_data(self, get_vaal_effect: bool = True) -> Mapping[str, Any]:
+		return all_gems[self.gem_data_name(get_vaal_effect)]
+
+	def gem_data_name(self, get_vaal_effect: bool = True) -> str:
 		if self.name.startswith('Vaal') and not get_vaal_effect:
-			return all_gems[self.original_name]
-		return all_gems[self.name]
+			return self.original_name
+		return self.name
 
 	def quality_effect(self, vaal_effect: bool) -> list:
 		return []
@@ -105,7 +111,7 @@ class SupportGem(Gem):
 		support_gem = self.get_gem_data()['support_gem']
 		self.allowed_types = {gem_type.lower() for gem_type in support_gem['allowed_types'] or []}
 		self.excluded_types = {gem_type.lower() for gem_type in support_gem['excluded_types'] or []}
-		self.support_gems_only = self.get_gem_data()['support_gem']['supports_gems_only'] or (socket is None)
+		self.support_gems_only = support_gem['supports_gems_only'] or (socket is None)
 		self.added_types = {gem_type.lower() for gem_type in support_gem['added_types'] or []}
 
 	def can_support(self, active_skill_gem: Gem, item: dict) -> bool:
@@ -248,203 +254,208 @@ class SkillGem(Gem):
 			self.supports.append(support_gem)
 
 	def get_aura(self, get_vaal_effect: bool) -> list[str]:
+		# iterating the effects also adds the effect of alternate qualities, so it has to happen before the lookup
+		effects = tuple(self.iterate_effects(get_vaal_effect))
+		aura_result = self.cached_lines(('aura', self.name, effects, self.aura_effect), self.aura_lines, effects)
+		if not aura_result:
+			return []
+
+		name = self.name
+		if name.startswith('Vaal') and not get_vaal_effect:
+			name = self.original_name
+		return self.result(name, aura_result, self.aura_effect)
+
+	def aura_lines(self, effects: tuple[tuple[str, float], ...]) -> list[str]:
 		aura_result: list[str] = []
 		previous_value: list[float] = []
-		for stat, value in self.iterate_effects(get_vaal_effect):
-			formatted_text, previous_value = self.translate_effect(stat, value, previous_value,
-					self.aura_effect, aura_translation)
-			if not formatted_text:
+		for stat, value in effects:
+			rule, values = self.translate(stat, value, previous_value, self.aura_effect, aura_translation)
+			if rule is None:
+				previous_value = values
 				continue
-			if m := re.search('you and nearby allies( deal| have| gain| are|) (.*)', formatted_text, re.IGNORECASE):
-				aura_result.append(m.group(2))
-			elif m := re.search("nearby allies' (.*)", formatted_text, re.IGNORECASE):
-				aura_result.append(f'Your {m.group(1)}')
-			elif formatted_text.startswith(('Aura grants ', 'Buff grants ')):
-				aura_result.append(formatted_text[len('Aura grants '):])
-			elif not formatted_text.startswith('You and nearby Non-Minion Allies have a '):
-				raise Exception(f'unhandled formatted line from {self.name}: {formatted_text}')
-
-		if not aura_result:
-			return []
+			previous_value = []
+			# the rewrite to what the line does for the character was done when preparing the data
+			if rule.aura is None:
+				raise Exception(f'unhandled formatted line from {self.name}: {rule.render(rule.string, values)}')
+			if rule.aura:
+				aura_result.append(rule.render(rule.aura, values))
+		return aura_result
+
+	def sweep_aura(self, get_vaal_effect: bool, aura_effects: list[int]) -> Optional[dict[str, Any]]:
+		"""
+		get_aura for every increased aura effect of the character in aura_effects at once. Every line is a template
+		with a column of values per placeholder, which has a value for each aura effect
+		"""
+		effects = self.iterate_effects(get_vaal_effect)
+		# supports, quality and aura specific mods add the same effect regardless of the character's aura effect
+		own_effect = self.aura_effect - self.character_stats.aura_effect
+		gem_effects = [own_effect + aura_effect for aura_effect in aura_effects]
+		lines = []
+		pending: list[tuple[data.TranslationRule, float]] = []
+		for stat, value in effects:
+			rule = self.rule_for(stat, value, aura_translation)
+			if rule is None:
+				pending = []
+				continue
+			pending.append((rule, value))
+			if len(rule.plus_signs) != len(pending):
+				continue
+			if rule.aura is None:
+				raise Exception(f'unhandled formatted line from {self.name}: {rule.string}')
+			if rule.aura:
+				lines.append({
+					'line': rule.render(rule.aura, ['#'] * len(pending)),
+					'values': [[value_rule.scale(value, effect) for effect in gem_effects]
+							for value_rule, value in pending],
+				})
+			pending = []
+		if not lines:
+			return None
 
-		if self.supports:
-			support_comment = '(' + ', '.join(f'{sup.name} {sup.level}' for sup in self.supports) + ')'
-		else:
-			support_comment = ''
 		name = self.name
 		if name.startswith('Vaal') and not get_vaal_effect:
 			name = self.original_name
-		special_quality = f'{self.quality_type.name} ' if self.quality_type != GemQualityType.Superior else ''
-		header = f'// {special_quality}{name} (lvl {self.level}, {self.quality}%) {support_comment} {self.aura_effect}%'
-		return [header, *aura_result]
+		source = self.result(name, [], self.aura_effect).source
+		return {**source, 'effect': gem_effects, 'lines': lines}
 
 	def get_curse(self) -> list[str]:
+		effects = tuple(self.iterate_effects())
+		curse_effect = self.get_curse_effect()
+		curse_result = self.cached_lines(('curse', self.name, effects, curse_effect), self.curse_lines, effects)
+		return self.result(self.name, curse_result, curse_effect)
+
+	def curse_lines(self, effects: tuple[tuple[str, float], ...]) -> list[str]:
 		curse_result: list[str] = []
 		previous_value: list[float] = []
-		for stat, value in self.iterate_effects():
-			formatted_text, previous_value = self.translate_effect(stat, value, previous_value,
-					self.get_curse_effect(), curse_translation)
-			if not formatted_text:
+		for stat, value in effects:
+			rule, values = self.translate(stat, value, previous_value, self.get_curse_effect(), curse_translation)
+			if rule is None:
+				previous_value = values
 				continue
-			if m := re.search(r'Other effects on Cursed enemies expire (\d+)% slower', formatted_text):
-				# ailments are a subsection of "effects", but the only ones that matter
-				# this would be inaccurate if there are other "more ailment duration" mods, but they are nonexistent
-				curse_result.append(f'{m.group(1)}% more Duration of Ailments')
-			elif 'Cursed Enemies are Debilitated' in formatted_text:
-				# debilitate is not recognised by pob
-				curse_result += ['Nearby Enemies deal 10% less damage', 'Nearby Enemies have 20% less movement speed.']
-			elif 'to Hits against Cursed Enemies' in formatted_text:
-				curse_result.append(formatted_text.replace('against Cursed Enemies', ''))
-			elif m := re.search(r'Cursed enemies grant (\d+) (Life|Mana) when Hit by (Attacks|Spells)', formatted_text):
-				curse_result.append(f'+{m.group(1)} {m.group(2)} gained for each Enemy hit by your {m.group(3)}')
-			elif m := re.search(r'Cursed Enemies grant (.*)% (Life|Mana) Leech when Hit by (Attack|Spell)s',
-								formatted_text, re.IGNORECASE):
-				curse_result.append(f'{m.group(1)}% of {m.group(3)} Damage leeched as {m.group(2)}')
-			elif m := re.search(r'Cursed enemies grant (\d+) (Life|Mana) when Killed', formatted_text):
-				curse_result.append(f'+{m.group(1)} {m.group(2)} gained on kill')
-			elif m := re.search('Hits (against|on) Cursed Enemies have (.*)', formatted_text):
-				curse_result.append(m.group(2))
-			elif m := re.search('Ailments inflicted on Cursed Enemies (.*)', formatted_text):
-				curse_result.append(f'Damaging Ailments {m.group(1)}')
-			elif m := re.search(r'Cursed enemies take (\d+)% increased Damage from Damage over Time effects',
-								formatted_text):
-				curse_result.append(f'Nearby Enemies have {m.group(1)}% increased Damage over Time taken')
-			elif m := re.search(r'Cursed enemies take (\d+)% increased Damage from Projectile Hits', formatted_text):
-				curse_result.append(f'Nearby Enemies take {m.group(1)}% increased Projectile Damage')
-			elif m := re.search(r'(Ignite|Freeze|Shock)(|s) on Cursed enemies (have|has) (\d+)% increased Duration',
-								formatted_text):
-				curse_result.append(f'{m.group(4)}% increased {m.group(1)} Duration on Enemies')
-			elif 'increased Duration of Elemental Ailments on Cursed enemies' in formatted_text:
-				curse_result.append(formatted_text.replace('on cursed Enemies', ''))
-			elif m := re.search(r'Hits have (\d+)% chance to (.*) Cursed Enemies', formatted_text):
-				curse_result.append(f'{m.group(1)}% Chance to {m.group(2)} Enemies on Hit')
-			elif any(substr in formatted_text.lower() for substr in ['split', 'charge', 'overkill']):
-				# not recognised by pob at all
+			previous_value = []
+			# the rewrite to what the line does to cursed enemies was done when preparing the data
+			if rule.curse is None:
+				print(f'unhandled formatted line from {self.name}: {rule.render(rule.string, values)}')
 				continue
-			elif m := re.search('^Cursed(.*)Enemies (.*)', formatted_text, re.IGNORECASE):
-				curse_result.append(f'Nearby Enemies {m.group(2)}')
-			else:
-				print(f'unhandled formatted line from {self.name}: {formatted_text}')
-
-		if self.supports:
-			support_comment = '(' + ', '.join(f'{sup.name} {sup.level}' for sup in self.supports) + ')'
-		else:
-			support_comment = ''
-		name = self.name
-		special_quality = f'{self.quality_type.name} ' if self.quality_type != GemQualityType.Superior else ''
-		header = f'// {special_quality}{name} (lvl {self.level}, {self.quality}%) ' \
-				f'{support_comment} {self.get_curse_effect()}%'
-		return [header, *curse_result]
+			curse_result += [line.format(*values) for line in rule.curse]
+		return curse_result
 
 	def get_mine(self) -> list[str]:
+		effects = tuple(self.iterate_effects())
+		mine_result = self.cached_lines(('mine', self.name, effects, self.aura_effect, self.mine_limit),
+				self.mine_lines, effects)
+		return self.result(self.name, mine_result, self.aura_effect)
+
+	def mine_lines(self, effects: tuple[tuple[str, float], ...]) -> list[str]:
 		mine_result: list[str] = []
 		previous_value: list[float] = []
-		for stat, value in self.iterate_effects():
-			formatted_text, previous_value = self.translate_effect(stat, value, previous_value, self.aura_effect,
-																   aura_translation)
-			if not formatted_text:
+		for stat, value in effects:
+			rule, values = self.translate(stat, value, previous_value, self.aura_effect, aura_translation)
+			if rule is None:
+				previous_value = values
 				continue
-			if m := re.search(r'Each Mine applies (\d+)% increased Damage Taken to Enemies '
-						r'near it, up\nto a maximum of (\d+)%', formatted_text):
-				value = min(int(m.group(1)) * self.mine_limit, int(m.group(2)))
-				mine_result.append(f'Nearby Enemies take {value}% increased damage')
-			elif m := re.search(r'Each Mine applies (\d+)% chance to deal Double Damage to Hits against Enemies '
-						r'near it, up to a maximum of (\d+)%', formatted_text):
-				value = min(int(m.group(1)) * self.mine_limit, int(m.group(2)))
-				mine_result.append(f'{value}% chance to deal double Damage')
-			elif m := re.search(r'Each Mine applies (\d+)% increased Critical Strike Chance to Hits against Enemies '
-						r'near it, up to a maximum of (\d+)%', formatted_text):
-				value = min(int(m.group(1)) * self.mine_limit, int(m.group(2)))
-				mine_result.append(f'{value}% increased Critical Strike Chance')
-			elif m := re.search(r'Each Mine Adds (\d+) to (\d+) Fire Damage to Hits against Enemies '
-						r'near it, up to a maximum of (\d+) to (\d+)', formatted_text):
-				values = (
-					min(int(m.group(1)) * self.mine_limit, int(m.group(3))),
-					min(int(m.group(2)) * self.mine_limit, int(m.group(4))),
-				)
-				mine_result.append(f'{values[0]} to {values[1]} added Fire Damage')
-
-		if self.supports:
-			support_comment = '(' + ', '.join(f'{sup.name} {sup.level}' for sup in self.supports) + ')'
-		else:
-			support_comment = ''
-		name = self.name
-		special_quality = f'{self.quality_type.name} ' if self.quality_type != GemQualityType.Superior else ''
-		header = f'// {special_quality}{name} (lvl {self.level}, {self.quality}%) ' \
-				f'{support_comment} {self.aura_effect}%'
-		return [header, *mine_result]
+			previous_value = []
+			if rule.mine is not None:
+				# every mine applies the effect, up to a maximum
+				mine_result.append(rule.mine.format(*(min(int(values[value_index]) * self.mine_limit,
+						int(values[cap_index])) for value_index, cap_index in rule.mine_caps)))
+		return mine_result
 
 	def get_link(self) -> list[str]:
-		link_result: list[str] = []
-		previous_value: list[float] = []
 		if self.name == 'Protective Link':
 			warnings.warn(
 				'Protective Link effect is not recognized by PoB. Manually adjust chance to block attack damage')
 		elif self.name == 'Destructive Link':
 			warnings.warn(
 				'Destructive Link effect is not recognized by PoB. Manually adjust Mainhand critical strike chance')
-		for stat, value in self.iterate_effects():
-			formatted_text, previous_value = self.translate_effect(stat, value, previous_value,
-					self.inc_link_effect, aura_translation)
+		effects = tuple(self.iterate_effects())
+		# Flame Link scales with the life of the character, the other links are the same for everyone
+		life = self.character_stats.life if self.name == 'Flame Link' else None
+		link_result = self.cached_lines(('link', self.name, effects, self.inc_link_effect, life), self.link_lines,
+				effects)
+		if not link_result:
+			return []
+		return self.result(self.name, link_result, self.inc_link_effect, effect_in_header=False)
 
-			if not formatted_text:
+	def link_lines(self, effects: tuple[tuple[str, float], ...]) -> list[str]:
+		link_result: list[str] = []
+		previous_value: list[float] = []
+		for stat, value in effects:
+			rule, values = self.translate(stat, value, previous_value, self.inc_link_effect, aura_translation)
+			if rule is None:
+				previous_value = values
 				continue
+			previous_value = []
+			if rule.link is None:
+				continue
+			if rule.link_life_percent is not None:
+				life_percent = int(values[rule.link_life_percent])
+				value = int(self.character_stats.life * (life_percent / 100) * (1 + self.inc_link_effect / 100))
+				link_result.append(rule.link.format(value))
+			else:
+				link_result.append(rule.link.format(*values))
+		return link_result
 
-			elif m := re.search(r'(\d+)% of Damage from Hits against target is taken', formatted_text):
-				link_result.append(f'{m.group(1)}% less damage taken from Hits')
-			elif m := re.search(r'Linked target takes (\d+)% less Damage', formatted_text):
-				link_result.append(f'{m.group(1)}% less damage taken')
-			elif m := re.search(r'Linked target gains Added Fire Damage equal to (\d+)% of your', formatted_text):
-				value = int(self.character_stats.life * (int(m.group(1)) / 100) * (1 + self.inc_link_effect / 100))
-				link_result.append(f'{value} to {value} Added Fire Damage')
-			elif m := re.search(r'Linked target Recovers (\d+) Life when they Block', formatted_text):
-				link_result.append(f'Recover {m.group(1)} Life when you Block')
-			elif m := re.search(r'Linked target (has|deals|gains) (.*)', formatted_text):
-				link_result.append(m.group(2))
-
-		if not link_result:
-			return []
+	@staticmethod
+	def cached_lines(key: tuple, translate: Callable[[tuple[tuple[str, float], ...]], list[str]],
+			effects: tuple[tuple[str, float], ...]) -> list[str]:
+		""" Returns translate(effects), which only depends on key """
+		lines = effect_lines.get(key)
+		if lines is None:
+			lines = tuple(translate(effects))
+			effect_lines.set(key, lines)
+		return list(lines)
+
+	def result(self, name: str, lines: list[str], effect: float, effect_in_header: bool = True) -> Result:
+		""" Adds a header with the gem, its supports and their increased effect """
 		if self.supports:
 			support_comment = '(' + ', '.join(f'{sup.name} {sup.level}' for sup in self.supports) + ')'
 		else:
 			support_comment = ''
-		name = self.name
 		special_quality = f'{self.quality_type.name} ' if self.quality_type != GemQualityType.Superior else ''
 		header = f'// {special_quality}{name} (lvl {self.level}, {self.quality}%) {support_comment}'
-		return [header, *link_result]
+		if effect_in_header:
+			header += f' {effect}%'
+		return Result([header, *lines], {
+			'type': 'gem',
+			'name': name,
+			'quality_type': self.quality_type.name,
+			'level': self.level,
+			'quality': self.quality,
+			'supports': [{'name': sup.name, 'level': sup.level} for sup in self.supports],
+			'effect': effect,
+		})
 
 	@staticmethod
-	def translate_effect(effect_id: str, effect_value: int, previous_effect_values: list[float],
-				scaling_factor: int, translation_dict: dict) -> Tuple[str, list[float]]:
+	def rule_for(effect_id: str, effect_value: float,
+			translation_dict: Mapping[str, tuple[data.TranslationRule, ...]]) -> Optional[data.TranslationRule]:
 		"""Finds the correct translation for an effect depending on the effects value"""
 		if effect_id not in translation_dict or effect_id == 'display_link_stuff':
-			return '', []
+			return None
+		for rule in translation_dict[effect_id]:
+			if rule.max >= effect_value >= rule.min:
+				return rule
+		if effect_value == 0:
+			return None
+		raise Exception(
+			f'Could not find the right translation for {effect_id} '
+			f'(value: {effect_value}) in {translation_dict[effect_id]}')
 
-		for translation in translation_dict[effect_id]:
-			condition = translation['condition'][0]
-			if condition == {}:
-				break
-			max = math.inf if condition['max'] is None else condition['max']
-			min = -math.inf if condition['min'] is None else condition['min']
-			if max >= effect_value >= min:
-				break
-		else:
-			if effect_value == 0:
-				return '', []
-			raise Exception(
-				f'Could not find the right translation for {effect_id} '
-				f'(value: {effect_value}) in {translation_dict[effect_id]}')
-		value = scaled_value(effect_value, scaling_factor, translation['index_handlers'][0])
-		previous_effect_values.append(value)
-		if len(translation['format']) == len(previous_effect_values):
-			formatted_values: list[Union[float, str]] = []
-			for fmt, value in zip(translation['format'], previous_effect_values):
-				if fmt == '+#':
-					formatted_values.append(f'+{value}')
-				else:
-					formatted_values.append(value)
-			return translation['string'].format(*formatted_values), []
-		return '', previous_effect_values
+	@staticmethod
+	def translate(effect_id: str, effect_value: float, previous_effect_values: list[float], scaling_factor: float,
+			translation_dict: Mapping[str, tuple[data.TranslationRule, ...]]) \
+			-> Tuple[Optional[data.TranslationRule], list[float]]:
+		"""
+		Returns the rule for the effect and its values once all of them are known, otherwise None and the values seen
+		so far
+		"""
+		rule = SkillGem.rule_for(effect_id, effect_value, translation_dict)
+		if rule is None:
+			return None, []
+		previous_effect_values.append(rule.scale(effect_value, scaling_factor))
+		if len(rule.plus_signs) == len(previous_effect_values):
+			return rule, previous_effect_values
+		return None, previous_effect_values
 
 
 def item_gem_dict(mod_string: str) -> dict:
@@ -471,35 +482,7 @@ def item_gem_dict(mod_string: str) -> dict:
 			'properties': [{'name': 'Level', 'values': [[str(level)]]}, {'name': 'Quality', 'values': [['+0%']]}]}
 
 
-def scaled_value(initial_value: int, factor: int, index_handlers: list[str]) -> Union[int, float]:
-	value = float(initial_value)
-	allow_float = False
-	for handler in index_handlers:
-		if handler == 'per_minute_to_per_second':
-			value /= 60
-			allow_float = True
-		elif handler == 'milliseconds_to_seconds_2dp':
-			value /= 1000
-			allow_float = True
-		elif handler == 'negate':
-			value *= -1
-			continue
-		elif handler == 'divide_by_one_hundred':
-			value /= 100
-			allow_float = True
-		elif handler == 'per_minute_to_per_second_2dp':
-			value /= 30
-			allow_float = True
-		else:
-			raise Exception('unhandled index_handler: ' + handler)
-	value *= 1 + factor / 100
-	if allow_float:
-		value = round(value, 1)
-	else:
-		value = int(value)
-	return value
-
-
+@metrics.span('gems')
 def parse_skills_in_item(item: dict, char_stats: 'Stats') -> list[SkillGem]:
 	socketed_items = item.get('socketedItems', [])
 	active_skills = []
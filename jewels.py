@@ -1,14 +1,24 @@
 import math
 import re
 import warnings
-from typing import TYPE_CHECKING, Optional, Tuple, no_type_check
+from collections import defaultdict, deque
+from collections.abc import Collection, Mapping
+from typing import TYPE_CHECKING, Tuple, no_type_check
 
 if TYPE_CHECKING:
 	from stats import Stats
 
-from data import TimelessJewelType, legion_passive_mapping, timeless_node_mapping
-
-legion_passive_effects = legion_passive_mapping()
+import cache
+import metrics
+from data import (
+	NodeIndex,
+	TimelessJewelType,
+	legion_passive_mapping,
+	timeless_node_mapping,
+	timeless_seed_columns,
+	timeless_stats,
+	tree_index,
+)
 
 notable_hashes_for_jewels = [
 	'26725', '36634', '33989', '41263', '60735', '61834', '31683', '28475', '6230', '48768', '34483', '7960',
@@ -20,52 +30,37 @@ notable_hashes_for_jewels = [
 
 
 class TreeGraph:
-	"""This class is used to determine the shortest paths between two passive skills in a given passive tree"""
-	def __init__(self, tree: dict, skills: dict):
-		# skills['hashes'] can contain hashes that are not part of the tree (cluster notables)
-		skill_hashes = {str(hash) for hash in skills['hashes']}
-		self.node_hashes: set[str] = skill_hashes & {node_hash for node_hash in tree['nodes'] if node_hash != 'root'}
-		self.tree = tree
-		self.id_for_hash: dict[str, int] = {node: idx for idx, node in enumerate(self.node_hashes)}
-		self.adjacency_list: dict[int, set] = {node: set() for node in range(len(self.node_hashes))}
-		self.fill_adjacency_list()
-
-	def fill_adjacency_list(self) -> None:
-		for idx, node_hash in enumerate(self.node_hashes):
-			node = self.tree['nodes'].get(node_hash)
-			if node is None:
+	"""Shortest paths between passive skills of a static tree that only go through the allocated ones"""
+	def __init__(self, tree: dict):
+		adjacency_list: defaultdict[str, set[str]] = defaultdict(set)
+		for node_hash, node in tree['nodes'].items():
+			if node_hash == 'root':
 				continue
-			for neighbour_hash in ((set(node.get('in', [])) | set(node.get('out', []))) & self.node_hashes):
-				self.add_edge(idx, self.id_for_hash[neighbour_hash])
-
-	def add_edge(self, node1: int, node2: int) -> None:
-		self.adjacency_list[node1].add(node2)
-		self.adjacency_list[node2].add(node1)
-
-	def bfs(self, start_node_hash: str, target_node_hash: str) -> float:
-		start_node = self.id_for_hash[start_node_hash]
-		target_node = self.id_for_hash[target_node_hash]
-		queue = [start_node]
-		visited = {start_node}
-		parent: dict[int, Optional[int]] = {start_node: None}
-		path_found = False
+			for neighbour_hash in node.get('in', []) + node.get('out', []):
+				if neighbour_hash != 'root':
+					adjacency_list[node_hash].add(neighbour_hash)
+					adjacency_list[neighbour_hash].add(node_hash)
+		self.adjacency_list: dict[str, frozenset[str]] = \
+				{node_hash: frozenset(neighbours) for node_hash, neighbours in adjacency_list.items()}
+		# characters with two Split Personalities and repeated analyses of a character search the same subgraph
+		self.distances = cache.LRUCache(256)
+
+	def distances_from(self, start_node_hashes: set[str], allocated: frozenset[str]) -> dict[str, int]:
+		""" Returns the distance from the closest start node to every allocated node that can be reached """
+		key = (frozenset(start_node_hashes), allocated)
+		distances = self.distances.get(key)
+		if distances is not None:
+			return distances
+		distances = {node_hash: 0 for node_hash in start_node_hashes}
+		queue = deque(start_node_hashes)
 		while queue:
-			current_node = queue.pop(0)
-			if current_node == target_node:
-				path_found = True
-				break
-			for next_node in self.adjacency_list[current_node] - visited:
-				queue.append(next_node)
-				parent[next_node] = current_node
-				visited.add(next_node)
-		if not path_found:
-			return math.inf
-
-		path_length = 0
-		while parent[target_node] is not None:
-			path_length += 1
-			target_node = parent[target_node]  # type: ignore[assignment]
-		return path_length
+			current_node = queue.popleft()
+			for next_node in self.adjacency_list.get(current_node, ()):
+				if next_node in allocated and next_node not in distances:
+					distances[next_node] = distances[current_node] + 1
+					queue.append(next_node)
+		self.distances.set(key, distances)
+		return distances
 
 
 def passive_node_coordinates(node: dict, tree: dict) -> Tuple[float, float]:
@@ -84,19 +79,46 @@ def in_radius(jewel_coordinates: tuple[float, float], passive_coordinates: tuple
 	return (jewel_x - passive_x) ** 2 + (jewel_y - passive_y) ** 2 < radius ** 2
 
 
-def nodes_in_radius(middle_passive: dict, radius: int, tree: dict) -> set[int]:
-	jewel_coordinates = passive_node_coordinates(middle_passive, tree)
-	passive_hashes = set()
-	for node_hash, node in tree['nodes'].items():
-		# exclude nodes that are not part of a group, masteries, jewel sockets or virtual class starting nodes
-		if 'group' not in node or node['group'] == 0 \
-				or node['name'].endswith('Mastery') \
-				or node.get('isJewelSocket') \
-				or node.get('classStartIndex') is not None:
-			continue
-		if in_radius(jewel_coordinates, passive_node_coordinates(node, tree), radius):
-			passive_hashes.add(int(node_hash))
-	return passive_hashes
+class RadiusIndex:
+	"""Buckets the coordinates of all passives that can be affected by jewels into a grid to speed up radius lookups"""
+	cell_size = 500
+
+	def __init__(self, tree: dict):
+		self.tree = tree
+		self.cells: defaultdict[tuple[int, int], list[tuple[int, Tuple[float, float]]]] = defaultdict(list)
+		self.results: dict[tuple[int, int], frozenset[int]] = {}
+		for node_hash, node in tree['nodes'].items():
+			# exclude nodes that are not part of a group, masteries, jewel sockets or virtual class starting nodes
+			if 'group' not in node or node['group'] == 0 \
+					or node['name'].endswith('Mastery') \
+					or node.get('isJewelSocket') \
+					or node.get('classStartIndex') is not None:
+				continue
+			coordinates = passive_node_coordinates(node, tree)
+			self.cells[self.cell(coordinates)].append((int(node_hash), coordinates))
+
+	def cell(self, coordinates: Tuple[float, float]) -> tuple[int, int]:
+		return math.floor(coordinates[0] / self.cell_size), math.floor(coordinates[1] / self.cell_size)
+
+	def nodes_in_radius(self, middle_passive: dict, radius: int) -> frozenset[int]:
+		key = (middle_passive['skill'], radius)
+		if key in self.results:
+			return self.results[key]
+		jewel_coordinates = passive_node_coordinates(middle_passive, self.tree)
+		min_x, min_y = self.cell((jewel_coordinates[0] - radius, jewel_coordinates[1] - radius))
+		max_x, max_y = self.cell((jewel_coordinates[0] + radius, jewel_coordinates[1] + radius))
+		passive_hashes = set()
+		for x in range(min_x, max_x + 1):
+			for y in range(min_y, max_y + 1):
+				for node_hash, coordinates in self.cells.get((x, y), []):
+					if in_radius(jewel_coordinates, coordinates, radius):
+						passive_hashes.add(node_hash)
+		result = self.results[key] = frozenset(passive_hashes)
+		return result
+
+
+def nodes_in_radius(middle_passive: dict, radius: int, tree: dict) -> frozenset[int]:
+	return tree_index(tree, RadiusIndex).nodes_in_radius(middle_passive, radius)
 
 
 def get_radius(jewel: dict, skills: dict) -> int:
@@ -112,6 +134,7 @@ def scale_numbers_in_string(string: str, scaling_factor: float) -> str:
 	return re.sub(r'(\d+)', lambda x: scale_effect(x.group(1), scaling_factor), string)
 
 
+@metrics.span('jewels')
 def process_transforming_jewels(tree: dict, skills: dict, stats: 'Stats', character: dict) \
 		-> Tuple[dict, dict, 'Stats']:
 	jewel_priority = {
@@ -238,7 +261,7 @@ class TimelessJewel:
 			node['stats'] += alt_mods['mods']
 
 	def _transform_keystone(self, node: dict) -> None:
-		node['stats'] = legion_passive_effects[alt_keystones[self.version]]
+		node['stats'] = legion_passive_mapping()[alt_keystones[self.version]]
 
 	def _transform_small_attribute(self, node: dict) -> None:
 		if self.jewel_type == TimelessJewelType.GLORIOUS_VANITY:
@@ -265,6 +288,53 @@ class TimelessJewel:
 			node['stats'] = ['+4 to Dexterity']
 
 
+# the radius of timeless jewels, which the character's jewel data only has for socketed ones
+TIMELESS_JEWEL_RADIUS = 1800
+
+
+def search_timeless_seeds(jewel_type: TimelessJewelType, socket_hash: str, allocated: Collection[str],
+		weights: Mapping[str, float], tree: dict, top: int = 10) -> list[tuple[int, float]]:
+	"""
+	Scores every seed of a timeless jewel in a socket by the weighted sum of the stats of the alternate passives it
+	gives the allocated passives in radius. Returns the best top seeds and their scores, best first
+	"""
+	# only imported here so requests that never search seeds don't pay for importing numpy
+	import numpy as np
+
+	socket = tree['nodes'].get(socket_hash)
+	if socket is None or not socket.get('isJewelSocket'):
+		raise ValueError(f'{socket_hash} is not a jewel socket')
+	stat_indexes = {stat: i for i, stat in enumerate(timeless_stats())}
+	stat_weights = np.zeros(len(stat_indexes))
+	for stat, weight in weights.items():
+		if stat not in stat_indexes:
+			raise ValueError(f'timeless jewels have no {stat} stat')
+		stat_weights[stat_indexes[stat]] = weight
+
+	passives = []
+	for node_hash in sorted(nodes_in_radius(socket, TIMELESS_JEWEL_RADIUS, tree)):
+		node = tree['nodes'][str(node_hash)]
+		if str(node_hash) not in allocated or node.get('isKeystone'):
+			continue
+		# the passives TimelessJewel.transform takes from the seed's mapping
+		if node.get('isNotable') or jewel_type == TimelessJewelType.GLORIOUS_VANITY:
+			passives.append(node_hash)
+
+	columns = timeless_seed_columns(jewel_type, passives)
+	scores = np.bincount(columns.seed_index, weights=stat_weights[columns.stat] * columns.value,
+			minlength=len(columns.seeds))
+	if not np.isfinite(scores).all():
+		raise ValueError('the weights are too large')
+	top = min(top, len(scores))
+	if top <= 0:
+		return []
+	# every seed that ties with the last of the best ones, so ties are broken by seed instead of partition order
+	threshold = scores[np.argpartition(-scores, top - 1)[top - 1]]
+	best = np.flatnonzero(scores >= threshold)
+	best = best[np.lexsort((columns.seeds[best], -scores[best]))][:top]
+	return [(int(seed), float(score)) for seed, score in zip(columns.seeds[best], scores[best])]
+
+
 def process_healthy_mind(jewel_data: dict, tree: dict, radius: int) -> dict:
 	"""Increases and Reductions to Life in Radius are Transformed to apply to Mana at 200% of their value"""
 	jewel = tree['nodes'][notable_hashes_for_jewels[jewel_data['x']]]
@@ -301,10 +371,10 @@ def process_might_of_the_meek(jewel_data: dict, tree: dict, radius: int) -> dict
 
 
 def class_starting_nodes(tree: dict, character: dict, skills: dict) -> set[str]:
-	for node in tree['nodes'].values():
-		if node.get('classStartIndex') == character['character']['classId']:
-			return {str(h) for h in skills['hashes']} & (set(node['in']) | set(node['out']))
-	return set()
+	node = tree_index(tree, NodeIndex).class_start_nodes.get(character['character']['classId'])
+	if node is None:
+		return set()
+	return {str(h) for h in skills['hashes']} & (set(node['in']) | set(node['out']))
 
 
 def get_cluster_root(jewel_hash: str, tree: dict) -> tuple[str, int]:
@@ -329,12 +399,9 @@ def get_cluster_root(jewel_hash: str, tree: dict) -> tuple[str, int]:
 def process_split_personality(jewel_data: dict, tree: dict, skills: dict, character: dict) -> dict:
 	jewel_hash = notable_hashes_for_jewels[jewel_data['x']]
 	jewel_hash, additional_distance = get_cluster_root(jewel_hash, tree)
-	g = TreeGraph(tree, skills)
-	minimum_distance = math.inf
-	for node in class_starting_nodes(tree, character, skills):
-		distance = g.bfs(node, jewel_hash)
-		if distance < minimum_distance:
-			minimum_distance = distance
+	allocated = frozenset(str(skill_hash) for skill_hash in skills['hashes'])
+	distances = tree_index(tree, TreeGraph).distances_from(class_starting_nodes(tree, character, skills), allocated)
+	minimum_distance = distances.get(jewel_hash, math.inf)
 	jewel_data['explicitMods'] = [scale_numbers_in_string(stat, 1 + 0.25 * (minimum_distance + additional_distance))
 								  for stat in jewel_data['explicitMods'][1:]]
 	return jewel_data
@@ -0,0 +1,91 @@
+""" Timing of the stages of a request, exposed in the Prometheus text format """
+import contextlib
+import contextvars
+import threading
+import time
+from collections.abc import Iterator
+from typing import Optional
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+	def __init__(self) -> None:
+		self.lock = threading.Lock()
+		self.bucket_counts = [0] * len(BUCKETS)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value: float) -> None:
+		with self.lock:
+			for i, bound in enumerate(BUCKETS):
+				if value <= bound:
+					self.bucket_counts[i] += 1
+			self.count += 1
+			self.sum += value
+
+
+stage_durations: dict[str, Histogram] = {}
+_stage_durations_lock = threading.Lock()
+# spans of the current request, if they are being collected for the Server-Timing header
+_request_spans: contextvars.ContextVar[Optional[list[tuple[str, float]]]] = \
+		contextvars.ContextVar('request_spans', default=None)
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record(stage, time.perf_counter() - start)
+
+
+def record(stage: str, duration: float) -> None:
+	""" Adds a stage that was timed elsewhere (e.g. in an analysis worker) as if it ran in a span here """
+	with _stage_durations_lock:
+		histogram = stage_durations.get(stage)
+		if histogram is None:
+			histogram = stage_durations[stage] = Histogram()
+	histogram.observe(duration)
+	spans = _request_spans.get()
+	if spans is not None:
+		spans.append((stage, duration))
+
+
+@contextlib.contextmanager
+def collect_spans() -> Iterator[list[tuple[str, float]]]:
+	spans: list[tuple[str, float]] = []
+	token = _request_spans.set(spans)
+	try:
+		yield spans
+	finally:
+		_request_spans.reset(token)
+
+
+def server_timing(spans: list[tuple[str, float]]) -> str:
+	""" Formats spans for the Server-Timing header, adding up stages that ran more than once """
+	totals: dict[str, float] = {}
+	for stage, duration in spans:
+		totals[stage] = totals.get(stage, 0) + duration
+	return ', '.join(f'{stage};dur={duration * 1000:.1f}' for stage, duration in totals.items())
+
+
+def prometheus(counters: dict[str, int]) -> str:
+	lines = [
+		'# HELP poecalc_stage_duration_seconds Time spent in each stage of a request',
+		'# TYPE poecalc_stage_duration_seconds histogram',
+	]
+	with _stage_durations_lock:
+		histograms = sorted(stage_durations.items())
+	for stage, histogram in histograms:
+		with histogram.lock:
+			for bound, count in zip(BUCKETS, histogram.bucket_counts):
+				lines.append(f'poecalc_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+			lines.append(f'poecalc_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+			lines.append(f'poecalc_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+			lines.append(f'poecalc_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+	for name, value in counters.items():
+		lines.append(f'# TYPE {name} counter')
+		lines.append(f'{name} {value}')
+	return '\n'.join(lines) + '\n'
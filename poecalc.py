@@ -3,21 +3,42 @@
 
 import sys
 
-if len(sys.argv) == 3:
+# analysis pool processes import this as __mp_main__ with the same argv, but must not be monkey patched
+if __name__ == '__main__' and len(sys.argv) == 3:
 	import eventlet
 	import eventlet.wsgi
 	eventlet.monkey_patch()
 
 # pylint: disable=wrong-import-position,wrong-import-order
+import asyncio
+import concurrent.futures
+import gc
+import hashlib
+import hmac
+import json
+import math
 import mimetypes
+import os
+import signal
+import time
+import traceback
 import warnings
+from collections.abc import AsyncIterator, Callable, Iterator
+from typing import Any, Optional
 
 from pigwig import PigWig, Response
 from pigwig.exceptions import HTTPException
 
 import auras
+import cache
+import config
+import data
 import gems
+import jewels
+import metrics
+import profiling
 import stats
+import workers
 
 def root(request):
 	return Response.render(request, 'index.jinja2', {})
@@ -26,43 +47,385 @@ def analyze_auras(request, account: str, character: str):
 	# eventlet encodes PATH_INFO as latin1
 	# https://github.com/eventlet/eventlet/blob/890f320b/eventlet/wsgi.py#L690
 	# because PEP-0333 says so https://github.com/eventlet/eventlet/pull/497
-	with warnings.catch_warnings(record=True) as warning_list:
-		account = account.encode('latin1').decode('utf-8')
-		character = character.encode('latin1').decode('utf-8')
+	account = account.encode('latin1').decode('utf-8')
+	character = character.encode('latin1').decode('utf-8')
+	aura_effect = request.query.get('aura_effect', '')
+	if config.profile_secret and 'profile' in request.query:
+		return profile_analysis(request, account, character, aura_effect)
+	with metrics.collect_spans() as spans:
+		try:
+			# concurrent requests for the same character share one fetch and analysis
+			page = analyses.do((account, character, aura_effect), render_analysis, account, character, aura_effect)
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(page, spans)
+
+
+async def analyze_auras_async(request, account: str, character: str):
+	""" analyze_auras for asgi.py, where waiting for pathofexile.com doesn't tie up a thread """
+	aura_effect = request.query.get('aura_effect', '')
+	if config.profile_secret and 'profile' in request.query:
+		return await asyncio.to_thread(profile_analysis, request, account, character, aura_effect)
+	with metrics.collect_spans() as spans:
+		try:
+			page = await async_analyses.do((account, character, aura_effect), render_analysis_async,
+					account, character, aura_effect)
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(page, spans)
+
+
+def analyze_auras_api(request, account: str, character: str):
+	""" The analysis as JSON, with the gem or other source of every result """
+	aura_effect = api_aura_effect(request)
+	with metrics.collect_spans() as spans:
+		try:
+			body = analyses.do((account, character, aura_effect, 'json'), render_analysis,
+					account, character, aura_effect, 'json')
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(body, spans, 'application/json')
+
+
+async def analyze_auras_api_async(request, account: str, character: str):
+	aura_effect = api_aura_effect(request)
+	with metrics.collect_spans() as spans:
+		try:
+			body = await async_analyses.do((account, character, aura_effect, 'json'), render_analysis_async,
+					account, character, aura_effect, 'json')
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(body, spans, 'application/json')
+
+
+def analyze_auras_sweep(request, account: str, character: str):
+	""" A table of the auras of a character for a range of increased aura effects """
+	return sweep_response(account, character, sweep_range(request), 'sweep')
+
+
+def analyze_auras_sweep_api(request, account: str, character: str):
+	return sweep_response(account, character, sweep_range(request), 'sweep_json')
+
+
+def sweep_response(account: str, character: str, aura_effects: str, output: str):
+	with metrics.collect_spans() as spans:
+		try:
+			page = analyses.do((account, character, aura_effects, output), render_analysis,
+					account, character, aura_effects, output)
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(page, spans, 'application/json' if output == 'sweep_json' else 'text/html; charset=utf-8')
+
+
+async def analyze_auras_sweep_async(request, account: str, character: str):
+	return await sweep_response_async(account, character, sweep_range(request), 'sweep')
+
+
+async def analyze_auras_sweep_api_async(request, account: str, character: str):
+	return await sweep_response_async(account, character, sweep_range(request), 'sweep_json')
+
+
+async def sweep_response_async(account: str, character: str, aura_effects: str, output: str):
+	with metrics.collect_spans() as spans:
+		try:
+			page = await async_analyses.do((account, character, aura_effects, output), render_analysis_async,
+					account, character, aura_effects, output)
+		except workers.Saturated:
+			raise HTTPException(503, 'too many characters are being analyzed right now, try again later\n') \
+					from None
+	return page_response(page, spans, 'application/json' if output == 'sweep_json' else 'text/html; charset=utf-8')
+
+
+MAX_SWEEP_STEPS = 101
+
+def sweep_range(request) -> str:
+	""" The aura effects to compare (?from=0&to=200&step=10 by default) as start:stop:step """
+	try:
+		start = int(request.query.get('from', 0))
+		stop = int(request.query.get('to', 200))
+		step = int(request.query.get('step', 10))
+	except ValueError:
+		raise HTTPException(400, 'from, to and step must be integers\n') from None
+	if step <= 0 or stop < start:
+		raise HTTPException(400, 'from must not be above to and step must be positive\n')
+	if (stop - start) // step >= MAX_SWEEP_STEPS:
+		raise HTTPException(400, f'at most {MAX_SWEEP_STEPS} aura effects can be compared at once\n')
+	return f'{start}:{stop}:{step}'
+
+
+def analyze_auras_bulk(request):
+	""" Analyzes a JSON list of [account, character] pairs, streaming a JSON line for each as soon as it's done """
+	characters = bulk_characters(request)
+	return Response(bulk_results(characters, api_aura_effect(request)), content_type='application/x-ndjson')
+
+
+def bulk_results(characters: list[tuple[str, str]], aura_effect: str) -> Iterator[bytes]:
+	with concurrent.futures.ThreadPoolExecutor(config.bulk_concurrency) as executor:
+		futures = {
+			executor.submit(analyses.do, (account, character, aura_effect, 'json'), render_analysis,
+					account, character, aura_effect, 'json'): (account, character)
+			for account, character in characters
+		}
+		try:
+			for future in concurrent.futures.as_completed(futures):
+				yield bulk_line(future, *futures[future])
+		finally:
+			# the client went away
+			for future in futures:
+				future.cancel()
+
+
+async def analyze_auras_bulk_async(request):
+	characters = bulk_characters(request)
+	return Response(bulk_results_async(characters, api_aura_effect(request)), content_type='application/x-ndjson')
+
+
+async def bulk_results_async(characters: list[tuple[str, str]], aura_effect: str) -> AsyncIterator[bytes]:
+	semaphore = asyncio.Semaphore(config.bulk_concurrency)
+	async def analyze_one(account: str, character: str) -> str:
+		async with semaphore:
+			return await async_analyses.do((account, character, aura_effect, 'json'), render_analysis_async,
+					account, character, aura_effect, 'json')
+
+	tasks = {asyncio.ensure_future(analyze_one(account, character)): (account, character)
+			for account, character in characters}
+	pending = set(tasks)
+	try:
+		while pending:
+			done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				yield bulk_line(task, *tasks[task])
+	finally:
+		# the client went away
+		for task in pending:
+			task.cancel()
+
+
+def bulk_characters(request) -> list[tuple[str, str]]:
+	characters = request.body
+	if not isinstance(characters, list) or not all(
+			isinstance(pair, list) and len(pair) == 2 and all(isinstance(name, str) for name in pair)
+			for pair in characters):
+		raise HTTPException(400, 'expected a JSON list of [account, character] pairs\n')
+	if len(characters) > config.bulk_max_characters:
+		raise HTTPException(400, f'at most {config.bulk_max_characters} characters can be analyzed at once\n')
+	return [(account, character) for account, character in characters]
+
+
+def bulk_line(future: concurrent.futures.Future | asyncio.Future, account: str, character: str) -> bytes:
+	try:
+		return future.result().encode('utf-8') + b'\n'
+	except HTTPException as e:
+		error = e.body.strip()
+	except workers.Saturated:
+		error = 'too many characters are being analyzed right now'
+	except Exception as e:
+		traceback.print_exc()
+		error = f'{e.__class__.__name__}: {e}'
+	return json.dumps({'account': account, 'character': character, 'error': error}).encode('utf-8') + b'\n'
+
+
+MAX_TIMELESS_SEEDS = 100
+
+def timeless_seeds(request):
+	"""
+	The best seeds of a timeless jewel for a socket and the allocated passives in its radius, scored by the weights of
+	the stats of their alternate passives, e.g.
+	{"jewel": "militant_faith", "socket": "61419", "passives": ["..."], "weights": {"aura_effect_x": 1}, "top": 10}
+	"""
+	query = request.body
+	if not isinstance(query, dict):
+		raise HTTPException(400, 'expected a JSON object\n')
+	try:
+		jewel_type = data.TimelessJewelType(query.get('jewel'))
+	except ValueError:
+		raise HTTPException(400, f'jewel must be one of {", ".join(t.value for t in data.TimelessJewelType)}\n') \
+				from None
+	socket = query.get('socket')
+	passives = query.get('passives')
+	weights = query.get('weights')
+	top = query.get('top', 10)
+	if not isinstance(socket, str) or not isinstance(passives, list) \
+			or not all(isinstance(passive, str) for passive in passives):
+		raise HTTPException(400, 'socket must be a passive hash and passives a list of them\n')
+	if not isinstance(weights, dict) or not all(finite_number(weight) for weight in weights.values()):
+		raise HTTPException(400, 'weights must map stat ids to finite numbers\n')
+	if isinstance(top, bool) or not isinstance(top, int) or not 0 < top <= MAX_TIMELESS_SEEDS:
+		raise HTTPException(400, f'top must be between 1 and {MAX_TIMELESS_SEEDS}\n')
+
+	tree, _ = stats.passive_skill_tree(bool(query.get('alternate_skill_tree')))
+	with metrics.span('timeless_seeds'):
 		try:
-			char_stats, char, skills, alternate_skill_tree = stats.fetch_stats(account, character)
-		except stats.CharacterNotFound:
-			return Response.render(request, 'auras.jinja2', {
-				'warnings': 'Could not fetch character. Make sure the spelling is correct.',
-				'account': account,
-				'character': character,
-			})
-
-		if 'aura_effect' in request.query and request.query['aura_effect'] != '':
-			char_stats.aura_effect = int(request.query['aura_effect'])
-
-		active_skills = []
-		for item in char['items']:
-			active_skills += gems.parse_skills_in_item(item, char_stats)
-
-		aura_results, vaal_aura_results = analyzer.analyze_auras(
-				char_stats, char, active_skills, skills, alternate_skill_tree)
-		curse_results = analyzer.analyze_curses(char_stats, active_skills)
-		mine_results = analyzer.analyze_mines(char_stats, active_skills)
-		link_results = analyzer.analyze_links(char_stats, active_skills)
-	return Response.render(request, 'auras.jinja2', {
-		'results': result_to_str(aura_results),
-		'vaal_results': result_to_str(vaal_aura_results),
-		'curse_results': result_to_str(curse_results),
-		'mine_results': result_to_str(mine_results),
-		'link_results': result_to_str(link_results),
-		'aura_effect': request.query['aura_effect'],
-		'warnings': prepare_warnings(warning_list),
+			seeds = jewels.search_timeless_seeds(jewel_type, socket, frozenset(passives), weights, tree, top)
+		except ValueError as e:
+			raise HTTPException(400, f'{e}\n') from None
+	return Response.json({'seeds': [{'seed': seed, 'score': score} for seed, score in seeds]})
+
+
+def finite_number(value: Any) -> bool:
+	# json.loads accepts NaN and Infinity, which would make every score NaN and the response invalid JSON
+	if isinstance(value, bool) or not isinstance(value, (int, float)):
+		return False
+	try:
+		return math.isfinite(value)
+	except OverflowError:  # ints too large for a float
+		return False
+
+
+def api_aura_effect(request) -> str:
+	aura_effect = request.query.get('aura_effect', '')
+	if aura_effect != '' and not aura_effect.lstrip('-').isdigit():
+		raise HTTPException(400, 'aura_effect must be an integer\n')
+	return aura_effect
+
+
+def page_response(page: str, spans: list[tuple[str, float]], content_type: str = 'text/html; charset=utf-8'):
+	extra_headers = []
+	if config.server_timing and spans:
+		extra_headers.append(('Server-Timing', metrics.server_timing(spans)))
+	return Response(page, content_type=content_type, extra_headers=extra_headers)
+
+
+def profile_analysis(request, account: str, character: str, aura_effect: str):
+	if not config.profile_secret:
+		raise HTTPException(404, 'profiling is disabled\n')
+	secret = request.query['profile']
+	# repeated parameters are lists
+	if not isinstance(secret, str) or not hmac.compare_digest(secret.encode(), config.profile_secret.encode()):
+		raise HTTPException(403, 'bad profile secret\n')
+	try:
+		char, skills, alternate_skill_tree = stats.fetch_character(account, character)
+	except stats.CharacterNotFound:
+		raise HTTPException(404, 'character not found\n') from None
+	# skip the single-flight, the rendered-page cache and the analysis pool so the whole analysis is measured
+	_, profiler = profiling.profile(render_character, account, character, aura_effect, char, skills,
+			alternate_skill_tree, True)
+	if request.query.get('format') == 'pstats':
+		return Response(profiling.dump(profiler), content_type='application/octet-stream',
+				extra_headers=[('Content-Disposition', 'attachment; filename="poecalc.pstats"')])
+	sort = request.query.get('sort', 'cumulative')
+	if sort not in profiling.SORT_KEYS:
+		raise HTTPException(400, 'sort must be one of %s\n' % ', '.join(sorted(profiling.SORT_KEYS)))
+	return Response(profiling.top_functions(profiler, sort), content_type='text/plain; charset=utf-8')
+
+
+def render_analysis(account: str, character: str, aura_effect: str, output: str = 'html') -> str:
+	try:
+		with metrics.span('fetch'):
+			char, skills, alternate_skill_tree = stats.fetch_character(account, character)
+	except stats.CharacterNotFound:
+		return render_not_found(account, character, output)
+	return render_character(account, character, aura_effect, char, skills, alternate_skill_tree, False, output)
+
+
+async def render_analysis_async(account: str, character: str, aura_effect: str, output: str = 'html') -> str:
+	try:
+		with metrics.span('fetch'):
+			char, skills, alternate_skill_tree = await stats.fetch_character_async(account, character)
+	except stats.CharacterNotFound:
+		return render_not_found(account, character, output)
+	# the analysis and rendering would block the event loop
+	return await asyncio.to_thread(render_character, account, character, aura_effect,
+			char, skills, alternate_skill_tree, False, output)
+
+
+def render_not_found(account: str, character: str, output: str = 'html') -> str:
+	if ANALYSES[output][1] is None:
+		raise HTTPException(404, 'character not found\n')
+	return app.template_engine.render('auras.jinja2', {
+		'warnings': 'Could not fetch character. Make sure the spelling is correct.',
 		'account': account,
 		'character': character,
 	})
 
 
+def render_character(account: str, character: str, aura_effect: str, char: dict, skills: dict,
+		alternate_skill_tree: bool, profiled: bool = False, output: str = 'html') -> str:
+	# most requests are reloads of characters that didn't change
+	key = hashlib.sha256(json.dumps([char, skills, alternate_skill_tree, aura_effect, account, character,
+			output, data.version()]).encode()).digest()
+	page = rendered_pages.get(key) if not profiled else None
+	if page is None:
+		analyze_fn, template = ANALYSES[output]
+		with metrics.span('analysis'):
+			if config.analysis_workers and not profiled:
+				context, spans, hits, misses = analysis_pool.run(analyze_in_worker, analyze_fn, char, skills,
+						alternate_skill_tree, aura_effect)
+				for stage, duration in spans:
+					metrics.record(stage, duration)
+				gems.effect_lines.count(hits, misses)
+			else:
+				context = analyze_fn(char, skills, alternate_skill_tree, aura_effect)
+		context.update({'account': account, 'character': character})
+		with metrics.span('render'):
+			if template is None:
+				page = json.dumps(context)
+			else:
+				page = app.template_engine.render(template, context)
+		rendered_pages.set(key, page)
+	return page
+
+
+def analyze_in_worker(analyze_fn: Callable[..., dict], *args: Any) -> tuple[dict, list[tuple[str, float]], int, int]:
+	"""
+	Runs in an analysis worker, reporting its stage timings and how its gem effect cache did, since /metrics and
+	Server-Timing only see the server process
+	"""
+	hits, misses = gems.effect_lines.hits, gems.effect_lines.misses
+	with metrics.collect_spans() as spans:
+		context = analyze_fn(*args)
+	return context, spans, gems.effect_lines.hits - hits, gems.effect_lines.misses - misses
+
+
+def analyze(char: dict, skills: dict, alternate_skill_tree: bool, aura_effect: str) -> dict:
+	with warnings.catch_warnings(record=True) as warning_list:
+		results = auras.analyze_character(char, skills, alternate_skill_tree,
+				int(aura_effect) if aura_effect != '' else None)
+	context = {name: result_to_str(result) for name, result in results.items()}
+	context['aura_effect'] = aura_effect
+	context['warnings'] = prepare_warnings(warning_list)
+	return context
+
+
+def analyze_json(char: dict, skills: dict, alternate_skill_tree: bool, aura_effect: str) -> dict:
+	with warnings.catch_warnings(record=True) as warning_list:
+		results = auras.analyze_character(char, skills, alternate_skill_tree,
+				int(aura_effect) if aura_effect != '' else None)
+	context = {name: [result_to_json(result) for result in result_list if result]
+			for name, result_list in results.items()}
+	context['warnings'] = [str(warning.message) for warning in warning_list]
+	return context
+
+
+def analyze_sweep(char: dict, skills: dict, alternate_skill_tree: bool, aura_effects: str) -> dict:
+	start, stop, step = (int(n) for n in aura_effects.split(':'))
+	with warnings.catch_warnings(record=True) as warning_list:
+		context = auras.sweep_character(char, skills, alternate_skill_tree, list(range(start, stop + 1, step)))
+	context['warnings'] = [str(warning.message) for warning in warning_list]
+	return context
+
+
+# the analysis and the template for every output of render_character, JSON outputs have no template
+ANALYSES: dict[str, tuple[Callable[..., dict], Optional[str]]] = {
+	'html': (analyze, 'auras.jinja2'),
+	'json': (analyze_json, None),
+	'sweep': (analyze_sweep, 'sweep.jinja2'),
+	'sweep_json': (analyze_sweep, None),
+}
+
+
+def result_to_json(result: list[str]) -> dict:
+	if isinstance(result, gems.Result):
+		# the source replaces the // comment
+		return {**result.source, 'lines': result[1:]}
+	return {'lines': result}
+
+
 def prepare_warnings(warning_list: list) -> str:
 	if not warning_list:
 		return ''
@@ -73,6 +436,16 @@ def result_to_str(results: list[list[str]]) -> str:
 	return '\n\n'.join('\n'.join(result) for result in results)
 
 
+def metrics_page(request):
+	return Response(metrics.prometheus({
+		'poecalc_result_cache_hits_total': rendered_pages.hits,
+		'poecalc_result_cache_misses_total': rendered_pages.misses,
+		'poecalc_gem_effect_cache_hits_total': gems.effect_lines.hits,
+		'poecalc_gem_effect_cache_misses_total': gems.effect_lines.misses,
+		'poecalc_analyses_shed_total': analysis_pool.shed,
+	}), content_type='text/plain; version=0.0.4')
+
+
 def static(request, path: str):
 	content_type, _ = mimetypes.guess_type(path)
 	try:
@@ -85,18 +458,129 @@ def static(request, path: str):
 routes = [
 	('GET', '/', root),
 	('GET', '/auras/<account>/<character>', analyze_auras),
+	('GET', '/api/auras/<account>/<character>', analyze_auras_api),
+	('GET', '/auras/<account>/<character>/sweep', analyze_auras_sweep),
+	('GET', '/api/auras/<account>/<character>/sweep', analyze_auras_sweep_api),
+	('POST', '/api/auras', analyze_auras_bulk),
+	('POST', '/api/timeless', timeless_seeds),
 	('GET', '/static/<path:path>', static),
+	('GET', '/metrics', metrics_page),
 ]
 
+def parse_json_body(body, length: Optional[int], params: dict[str, str]):
+	# pigwig parses the body before routing, so a handler never gets to reject a malformed one itself
+	if length == 0:
+		return {}
+	try:
+		return PigWig.handle_json(body, length, params)
+	except ValueError:  # JSONDecodeError and UnicodeDecodeError
+		raise HTTPException(400, 'the body must be valid JSON\n') from None
+
+
 app = PigWig(routes, template_dir='templates')
-analyzer = auras.Auras()
+app.content_handlers = {**PigWig.content_handlers, 'application/json': parse_json_body}
+analyses = cache.SingleFlight()
+async_analyses = cache.AsyncSingleFlight()
+# handlers that asgi.py awaits instead of running the WSGI app in a thread
+async_routes = {
+	analyze_auras: analyze_auras_async,
+	analyze_auras_api: analyze_auras_api_async,
+	analyze_auras_bulk: analyze_auras_bulk_async,
+	analyze_auras_sweep: analyze_auras_sweep_async,
+	analyze_auras_sweep_api: analyze_auras_sweep_api_async,
+}
+rendered_pages = cache.LRUCache(config.result_cache_size)
+analysis_pool = workers.BoundedPool(config.analysis_workers, config.analysis_queue_depth)
+
+
+def preload() -> None:
+	""" Loads the data every request uses, so pre-forked workers share it instead of each loading their own copy """
+	for alternate_skill_tree in (False, True):
+		tree, _ = stats.passive_skill_tree(alternate_skill_tree)
+		data.tree_index(tree, jewels.RadiusIndex)
+		data.tree_index(tree, jewels.TreeGraph)
+		data.tree_index(tree, data.NodeIndex)
+	data.legion_passive_mapping()
+	data.timeless_stats()
+	for table in (gems.all_gems, gems.aura_translation, gems.curse_translation):
+		for key in table:
+			table.get_record(key)
+	app.template_engine.jinja_env.get_template('auras.jinja2')
+
+
+def after_fork(worker: int) -> None:
+	# sqlitedict connections are served by a thread, which doesn't survive a fork
+	for table in (gems.all_gems, gems.aura_translation, gems.curse_translation):
+		table.reopen()
+	data.reopen()
+	# a worker that is re-forked takes over the file of the one it replaces
+	stats.upstream_cache.reopen(f'{config.upstream_cache_path}.{worker}' if config.upstream_cache_path else None)
+
+
+# seconds a worker has to run before it counts as started, and the longest wait before re-forking one that didn't
+MIN_WORKER_UPTIME = 10
+MAX_RESPAWN_DELAY = 60
+
+def serve_forked(sock, processes: int) -> None:
+	preload()
+	# keep the garbage collector from touching (and so copying) the preloaded objects in every worker
+	gc.freeze()
+
+	def spawn(worker: int) -> int:
+		pid = os.fork()
+		if pid == 0:
+			# the child must never get back to the supervisor loop below, or it would start forking workers too
+			exit_code = 1
+			try:
+				after_fork(worker)
+				eventlet.wsgi.server(sock, app)
+				exit_code = 0
+			except Exception:
+				traceback.print_exc()
+			finally:
+				analysis_pool.shutdown()
+				os._exit(exit_code)
+		started[pid] = (worker, time.monotonic())
+		return pid
+
+	# the number of the worker each process is and when it was forked
+	started: dict[int, tuple[int, float]] = {}
+	for worker in range(processes):
+		spawn(worker)
+	respawn_delay = 0.0
+	try:
+		while True:
+			pid, status = os.wait()
+			worker, start = started.pop(pid)
+			uptime = time.monotonic() - start
+			print('worker', pid, 'exited with', os.waitstatus_to_exitcode(status), file=sys.stderr)
+			# back off from workers that die right after starting instead of re-forking them in a tight loop
+			if uptime < MIN_WORKER_UPTIME:
+				respawn_delay = min(max(respawn_delay * 2, 1), MAX_RESPAWN_DELAY)
+				time.sleep(respawn_delay)
+			else:
+				respawn_delay = 0
+			spawn(worker)
+	finally:
+		for pid in started:
+			os.kill(pid, signal.SIGTERM)
 
 
 def main() -> None:
 	if len(sys.argv) == 3:
 		addr = sys.argv[1]
 		port = int(sys.argv[2])
-		eventlet.wsgi.server(eventlet.listen((addr, port)), app)
+		sock = eventlet.listen((addr, port))
+		# exit cleanly so the analysis pool processes are stopped too
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+		processes = config.workers or os.cpu_count() or 1
+		if processes > 1:
+			serve_forked(sock, processes)
+		else:
+			try:
+				eventlet.wsgi.server(sock, app)
+			finally:
+				analysis_pool.shutdown()
 	else:
 		app.main()
 
@@ -0,0 +1,31 @@
+""" Runs a single request under cProfile so pathological characters can be investigated in production """
+import cProfile
+import io
+import marshal
+import pstats
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+T = TypeVar('T')
+
+SORT_KEYS = frozenset(['cumulative', 'tottime', 'ncalls', 'pcalls'])
+
+
+def profile(fn: Callable[..., T], *args: Any) -> tuple[T, cProfile.Profile]:
+	# fn must not wait on I/O: under eventlet every request is a greenlet on the same thread, so whatever the hub runs
+	# in the meantime would be profiled too
+	profiler = cProfile.Profile()
+	result = profiler.runcall(fn, *args)
+	return result, profiler
+
+
+def top_functions(profiler: cProfile.Profile, sort: str = 'cumulative', limit: int = 50) -> str:
+	out = io.StringIO()
+	pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+	return out.getvalue()
+
+
+def dump(profiler: cProfile.Profile) -> bytes:
+	""" The same format as pstats.Stats.dump_stats, to be loaded with pstats or snakeviz """
+	profiler.create_stats()
+	return marshal.dumps(profiler.stats) # type: ignore[attr-defined]
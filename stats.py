@@ -1,14 +1,21 @@
+import asyncio
+import concurrent.futures
+import functools
 import json
 import re
 import warnings
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Iterator
+from typing import Any, Iterator, Optional
 
 import httpx
 
+import cache
+import config
+import data
 import gems
 import jewels
+import metrics
 
 @dataclass
 class Stats:
@@ -55,27 +62,101 @@ class Stats:
 	militant_faith_aura_effect: bool = False
 
 
-client = httpx.Client(timeout=15)
-client.headers['User-Agent'] = 'Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0'
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0'
+client = httpx.Client(timeout=15, headers={'User-Agent': USER_AGENT}, limits=httpx.Limits(
+		max_connections=50, max_keepalive_connections=20, keepalive_expiry=60))
+# used instead of client and upstream_pool when serving with asyncio (asgi.py)
+async_client = httpx.AsyncClient(timeout=15, headers={'User-Agent': USER_AGENT}, limits=httpx.Limits(
+		max_connections=50, max_keepalive_connections=20, keepalive_expiry=60))
+# these are green threads when running under eventlet
+upstream_pool = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='upstream')
+upstream_cache = cache.TTLCache(config.upstream_cache_ttl, config.upstream_cache_size, config.upstream_cache_path)
 
 class CharacterNotFound(Exception):
 	pass
 
 def fetch_stats(account: str, character_name: str) -> tuple[Stats, dict, dict, bool]:
-	params = {'accountName': account, 'character': character_name, 'realm': 'pc'}
+	character, skills, alternate_skill_tree = fetch_character(account, character_name)
+	return stats_for_character(character, skills, alternate_skill_tree)
+
+
+def fetch_character(account: str, character_name: str, realm: str = 'pc') -> tuple[dict, dict, bool]:
+	""" Returns the items, passive skills and whether the character uses the alternate tree """
+	key = f'{realm}/{account}/{character_name}'
+	cached, fresh = upstream_cache.get(key)
+	if not fresh:
+		with metrics.span('upstream'):
+			cached = _fetch_character(account, character_name, realm, cached)
+		upstream_cache.set(key, cached)
+	return _decode_cached_character(cached)
+
+
+async def fetch_character_async(account: str, character_name: str, realm: str = 'pc') -> tuple[dict, dict, bool]:
+	""" fetch_character for asyncio """
+	key = f'{realm}/{account}/{character_name}'
+	cached, fresh = upstream_cache.get(key)
+	if not fresh:
+		with metrics.span('upstream'):
+			cached = await _fetch_character_async(account, character_name, realm, cached)
+		upstream_cache.set(key, cached)
+	return _decode_cached_character(cached)
+
+
+def _decode_cached_character(cached: dict) -> tuple[dict, dict, bool]:
+	# the responses are cached as text because the analysis modifies them
+	return json.loads(cached['items']['body']), json.loads(cached['skills']['body']), cached['alternate_skill_tree']
+
+
+def _fetch_character(account: str, character_name: str, realm: str, cached: Optional[dict]) -> dict:
+	params = {'accountName': account, 'character': character_name, 'realm': realm}
 	r = client.post('https://www.pathofexile.com/character-window/get-characters', data=params)
-	r.raise_for_status()
-	for character in r.json():
+	alternate_skill_tree = _uses_alternate_skill_tree(r, character_name)
+
+	# items and passives don't depend on each other, so they are fetched concurrently
+	cached_items = cached['items'] if cached else None
+	cached_skills = cached['skills'] if cached else None
+	items_request = upstream_pool.submit(_revalidate, 'POST',
+			'https://www.pathofexile.com/character-window/get-items', params, cached_items)
+	skills_request = upstream_pool.submit(_revalidate, 'GET',
+			'https://www.pathofexile.com/character-window/get-passive-skills', params, cached_skills)
+	items = _remove_inactive_cached_items(items_request.result(), cached_items)
+	return {'items': items, 'skills': skills_request.result(), 'alternate_skill_tree': alternate_skill_tree}
+
+
+async def _fetch_character_async(account: str, character_name: str, realm: str, cached: Optional[dict]) -> dict:
+	params = {'accountName': account, 'character': character_name, 'realm': realm}
+	r = await async_client.post('https://www.pathofexile.com/character-window/get-characters', data=params)
+	alternate_skill_tree = _uses_alternate_skill_tree(r, character_name)
+
+	cached_items = cached['items'] if cached else None
+	cached_skills = cached['skills'] if cached else None
+	items, skills = await asyncio.gather(
+		_revalidate_async('POST', 'https://www.pathofexile.com/character-window/get-items', params, cached_items),
+		_revalidate_async('GET', 'https://www.pathofexile.com/character-window/get-passive-skills', params,
+				cached_skills),
+	)
+	items = _remove_inactive_cached_items(items, cached_items)
+	return {'items': items, 'skills': skills, 'alternate_skill_tree': alternate_skill_tree}
+
+
+def _uses_alternate_skill_tree(characters_response: httpx.Response, character_name: str) -> bool:
+	characters_response.raise_for_status()
+	for character in characters_response.json():
 		if character['name'] == character_name:
-			alternate_skill_tree = character['league'] == 'Phrecia'
-			break
-	else:
-		raise CharacterNotFound
+			return character['league'] == 'Phrecia'
+	raise CharacterNotFound
 
-	params['character'] = character_name
-	r = client.post('https://www.pathofexile.com/character-window/get-items', data=params)
-	r.raise_for_status()
-	character = r.json()
+
+def _remove_inactive_cached_items(items: dict, cached_items: Optional[dict]) -> dict:
+	if items is not cached_items:
+		character = json.loads(items['body'])
+		remove_inactive_items(character)
+		items['body'] = json.dumps(character)
+	return items
+
+
+def remove_inactive_items(character: dict) -> None:
+	""" Removes weapon swap items and replaces Kalandra's Touch with the ring it copies """
 	new_items = []
 	for item in character['items']:
 		if item['inventoryId'] in ['Weapon2', 'Offhand2']:
@@ -90,14 +171,45 @@ def fetch_stats(account: str, character_name: str) -> tuple[Stats, dict, dict, b
 			new_items.append(item)
 	character['items'] = new_items
 
-	r = client.get('https://www.pathofexile.com/character-window/get-passive-skills', params=params)
+
+def _revalidate(method: str, url: str, params: dict, cached: Optional[dict]) -> dict:
+	""" Requests url, unless the server confirms that the cached response is still valid """
+	if method == 'POST':
+		r = client.post(url, data=params, headers=_conditional_headers(cached))
+	else:
+		r = client.get(url, params=params, headers=_conditional_headers(cached))
+	return _cache_entry(r, cached)
+
+
+async def _revalidate_async(method: str, url: str, params: dict, cached: Optional[dict]) -> dict:
+	if method == 'POST':
+		r = await async_client.post(url, data=params, headers=_conditional_headers(cached))
+	else:
+		r = await async_client.get(url, params=params, headers=_conditional_headers(cached))
+	return _cache_entry(r, cached)
+
+
+def _conditional_headers(cached: Optional[dict]) -> dict[str, str]:
+	headers = {}
+	if cached is not None:
+		if 'etag' in cached['validators']:
+			headers['If-None-Match'] = cached['validators']['etag']
+		if 'last-modified' in cached['validators']:
+			headers['If-Modified-Since'] = cached['validators']['last-modified']
+	return headers
+
+
+def _cache_entry(r: httpx.Response, cached: Optional[dict]) -> dict:
+	if r.status_code == 304 and cached is not None:
+		return cached
 	r.raise_for_status()
-	skills = r.json()
-	return stats_for_character(character, skills, alternate_skill_tree)
+	validators = {header: r.headers[header] for header in ['etag', 'last-modified'] if header in r.headers}
+	return {'validators': validators, 'body': r.text}
 
 
 def stats_for_character(character: dict, skills: dict, alternate_skill_tree: bool) -> tuple[Stats, dict, dict, bool]:
-	tree, masteries = passive_skill_tree(alternate_skill_tree)
+	with metrics.span('tree'):
+		tree, masteries = passive_skill_tree(alternate_skill_tree)
 	# find the tree for this class
 	class_name = character['character']['class'] # "Scion" or "Ascendant"
 	for class_tree in tree['classes']:
@@ -118,16 +230,17 @@ def stats_for_character(character: dict, skills: dict, alternate_skill_tree: boo
 	)
 	tree, skills, stats = jewels.process_transforming_jewels(tree, skills, stats, character)
 
-	for item in character['items']:
-		_parse_item(stats, item, tree)
-	for item in skills['items']:  # jewels
-		if 'Cluster Jewel' in item['typeLine']:  # skip cluster jewel base node
-			continue
-		_parse_item(stats, item, tree)
-	for notable_hash in stats.additional_notables:
-		skills['hashes'].append(notable_hash)
-	for _, node_stats in iter_passives(tree, masteries, skills):
-		_parse_mods(stats, node_stats, tree)
+	with metrics.span('mods'):
+		for item in character['items']:
+			_parse_item(stats, item, tree)
+		for item in skills['items']:  # jewels
+			if 'Cluster Jewel' in item['typeLine']:  # skip cluster jewel base node
+				continue
+			_parse_item(stats, item, tree)
+		for notable_hash in stats.additional_notables:
+			skills['hashes'].append(notable_hash)
+		for _, node_stats in iter_passives(tree, masteries, skills):
+			_parse_mods(stats, node_stats, tree)
 
 	if stats.militant_faith_aura_effect:
 		stats.aura_effect += stats.devotion // 10
@@ -166,18 +279,9 @@ def iter_passives(tree: dict, masteries: dict, skills: dict) -> Iterator[tuple[s
 
 
 def passive_skill_tree(alternate_skill_tree: bool) -> tuple[dict, dict]:
-	path = 'data/skill_tree_alternate.json' if alternate_skill_tree else 'data/skill_tree.json'
-	print('using skill tree', path)
-	with open(path, 'r', encoding='utf8') as file:
-		tree_dict = json.load(file)
-
-	masteries_dict = {}
-	for node in tree_dict['nodes'].values():
-		if 'masteryEffects' not in node:
-			continue
-		for effect in node['masteryEffects']:
-			masteries_dict[effect['effect']] = {'name': node['name'], 'stats': effect['stats']}
-	return tree_dict, masteries_dict
+	""" Returns a per-request tree on top of the cached one, along with the (shared, read-only) masteries dict """
+	tree, masteries = data.passive_skill_tree(alternate_skill_tree)
+	return {**tree, 'nodes': data.PassiveNodes(tree['nodes'])}, masteries
 
 
 matchers = [(re.compile(pattern), attr) for pattern, attr in [
@@ -219,47 +323,55 @@ def _parse_item(stats: Stats, item: dict, tree: dict) -> None:
 		_parse_mods(stats, item[modlist], tree)
 
 
+# any mod that doesn't match this can be skipped without trying every matcher, which is true for most passives
+any_matcher = re.compile('|'.join(f'(?:{regex.pattern})' for regex, _ in matchers))
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _match_mod(mod: str) -> tuple[tuple[str, tuple[Any, ...]], ...]:
+	""" Returns the attribute and the groups for every matcher of a mod """
+	if not any_matcher.search(mod):
+		return ()
+	return tuple((attr, m.groups()) for regex, attr in matchers if (m := regex.search(mod)))
+
+
 def _parse_mods(stats: Stats, mods: list[str], tree: dict) -> None:
 	for mod in mods:
-		for regex, attr in matchers:
-			m = regex.search(mod)
-			if m:
-				if attr == 'specific_aura_effect':
-					stats.specific_aura_effect[m.group(1)] += int(m.group(2))
-				elif attr == 'global_level':
-					stats.global_gem_level_increase += gems.parse_gem_descriptor(m.group(2), int(m.group(1)))
-				elif attr == 'global_quality':
-					stats.global_gem_quality_increase += gems.parse_gem_descriptor(m.group(2), int(m.group(1)))
-				elif attr == 'additional_notable':
-					notable = m.group(1)
-					if ' if you have the matching modifier on' in notable:
-						notable = notable.split(' if you have the matching modifier on')[0]
-					stats.additional_notables |= {hash_for_notable(notable, tree)}
-				elif attr == 'alt_quality_bonus':
-					# TODO: handle quality % on item
-					_parse_mods(stats, [jewels.scale_numbers_in_string(m.group(1), 20 // int(m.group(2)))], tree)
-				elif attr == 'inc_curse_effect':
-					if m.group(2) == 'in':
-						stats.inc_curse_effect += int(m.group(1))
-					else:
-						stats.inc_curse_effect -= int(m.group(1))
-				elif attr == 'more_curse_effect':
-					if m.group(2) == 'more':
-						stats.more_curse_effect += int(m.group(1))
-					else:
-						stats.more_curse_effect -= int(m.group(1))
-				elif attr == 'specific_curse_effect':
-					stats.specific_curse_effect[m.group(2)] += int(m.group(1))
-				elif attr == 'link_exposure':
-					stats.link_exposure = True
+		for attr, groups in _match_mod(mod):
+			if attr == 'specific_aura_effect':
+				stats.specific_aura_effect[groups[0]] += int(groups[1])
+			elif attr == 'global_level':
+				stats.global_gem_level_increase += gems.parse_gem_descriptor(groups[1], int(groups[0]))
+			elif attr == 'global_quality':
+				stats.global_gem_quality_increase += gems.parse_gem_descriptor(groups[1], int(groups[0]))
+			elif attr == 'additional_notable':
+				notable = groups[0]
+				if ' if you have the matching modifier on' in notable:
+					notable = notable.split(' if you have the matching modifier on')[0]
+				stats.additional_notables |= {hash_for_notable(notable, tree)}
+			elif attr == 'alt_quality_bonus':
+				# TODO: handle quality % on item
+				_parse_mods(stats, [jewels.scale_numbers_in_string(groups[0], 20 // int(groups[1]))], tree)
+			elif attr == 'inc_curse_effect':
+				if groups[1] == 'in':
+					stats.inc_curse_effect += int(groups[0])
 				else:
-					setattr(stats, attr, getattr(stats, attr) + int(m.group(1)))
+					stats.inc_curse_effect -= int(groups[0])
+			elif attr == 'more_curse_effect':
+				if groups[1] == 'more':
+					stats.more_curse_effect += int(groups[0])
+				else:
+					stats.more_curse_effect -= int(groups[0])
+			elif attr == 'specific_curse_effect':
+				stats.specific_curse_effect[groups[1]] += int(groups[0])
+			elif attr == 'link_exposure':
+				stats.link_exposure = True
+			else:
+				setattr(stats, attr, getattr(stats, attr) + int(groups[0]))
 
 
 def hash_for_notable(notable: str, tree: dict) -> str:
-	for hash_value, node in tree['nodes'].items():
-		if hash_value == 'root':
-			continue
-		if node['name'] == notable:
-			return hash_value
-	raise FileNotFoundError(f'Notable "{notable}" could not be found in tree')
+	try:
+		return data.tree_index(tree, data.NodeIndex).hash_for_name[notable]
+	except KeyError:
+		raise FileNotFoundError(f'Notable "{notable}" could not be found in tree') from None
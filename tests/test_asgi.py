@@ -0,0 +1,68 @@
+# type: ignore
+import asyncio
+import json
+import unittest
+import unittest.mock
+from typing import Any
+
+import asgi
+import config
+import data
+import poecalc
+from jewels import notable_hashes_for_jewels
+
+def call(method: str, path: str, body: bytes = b'', content_type: str = 'application/json',
+		query_string: bytes = b'') -> tuple[int, bytes]:
+	""" Sends one request through the ASGI adapter and returns the status and body of the response """
+	scope = {
+		'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'http_version': '1.1',
+		'headers': [],
+	}
+	if body:
+		scope['headers'] = [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+	messages: list[dict[str, Any]] = []
+	async def receive() -> dict:
+		return {'type': 'http.request', 'body': body, 'more_body': False}
+	async def send(message: dict) -> None:
+		messages.append(message)
+
+	asyncio.run(asgi.app(scope, receive, send))
+	status = messages[0]['status']
+	return status, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+class TestAsgi(unittest.TestCase):
+	def test_sync_route_gets_the_request_body(self) -> None:
+		# /api/timeless has no async handler, so the WSGI app has to read the body itself
+		status, body = call('POST', '/api/timeless', json.dumps({'jewel': 'nope'}).encode())
+		assert status == 400
+		assert body.startswith(b'jewel must be one of')
+
+	def test_timeless_seeds(self) -> None:
+		query = {
+			'jewel': 'militant_faith', 'socket': notable_hashes_for_jewels[0], 'passives': [],
+			'weights': {stat: 1 for stat in data.timeless_stats()}, 'top': 3,
+		}
+		status, body = call('POST', '/api/timeless', json.dumps(query).encode())
+		assert status == 200
+		assert len(json.loads(body)['seeds']) == 3
+		status, body = call('POST', '/api/timeless', json.dumps({**query, 'top': True}).encode())
+		assert status == 400
+		assert body.startswith(b'top must be between')
+
+	def test_malformed_json_is_a_bad_request(self) -> None:
+		# /api/auras has an async handler, /api/timeless runs in the WSGI app
+		for path in ('/api/auras', '/api/timeless'):
+			status, body = call('POST', path, b'[["account", ')
+			assert status == 400
+			assert body == b'the body must be valid JSON\n'
+
+	def test_profiling_checks_the_secret_first(self) -> None:
+		with unittest.mock.patch.object(config, 'profile_secret', 'secret'):
+			for query_string in (b'profile=wrong', b'profile=secret&profile=secret'):
+				status, _ = call('GET', '/auras/account/character', query_string=query_string)
+				assert status == 403
+		request = unittest.mock.Mock(query={'profile': ''})
+		with unittest.mock.patch.object(config, 'profile_secret', ''), self.assertRaises(poecalc.HTTPException) as e:
+			poecalc.profile_analysis(request, 'account', 'character', '')
+		assert e.exception.code == 404
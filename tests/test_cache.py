@@ -0,0 +1,164 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import httpx
+
+import stats
+from cache import AsyncSingleFlight, SingleFlight, TTLCache
+
+class TestTTLCache(unittest.TestCase):
+	def test_entries_become_stale_after_the_ttl(self) -> None:
+		ttl_cache = TTLCache(ttl=60, max_size=10)
+		with unittest.mock.patch('time.time', return_value=1000):
+			ttl_cache.set('key', 'value')
+		with unittest.mock.patch('time.time', return_value=1059):
+			assert ttl_cache.get('key') == ('value', True)
+		# stale entries are still returned so they can be revalidated
+		with unittest.mock.patch('time.time', return_value=1060):
+			assert ttl_cache.get('key') == ('value', False)
+		assert ttl_cache.get('missing') == (None, False)
+
+	def test_least_recently_used_entries_are_evicted(self) -> None:
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'cache.db')
+			ttl_cache = TTLCache(ttl=60, max_size=2, path=path)
+			ttl_cache.set('a', 1)
+			ttl_cache.set('b', 2)
+			ttl_cache.get('a')
+			ttl_cache.set('c', 3)
+			assert list(ttl_cache.entries) == ['a', 'c']
+			assert ttl_cache.db is not None and set(ttl_cache.db.keys()) == {'a', 'c'}
+			ttl_cache.db.close()
+			# the entries are loaded again on startup
+			ttl_cache = TTLCache(ttl=60, max_size=2, path=path)
+			assert ttl_cache.get('c')[0] == 3
+			assert ttl_cache.db is not None
+			ttl_cache.db.close()
+
+	def test_workers_reopen_their_own_file(self) -> None:
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'cache.db')
+			ttl_cache = TTLCache(ttl=60, max_size=2, path=path)
+			ttl_cache.set('a', 1)
+			assert ttl_cache.db is not None
+			ttl_cache.db.close()
+			ttl_cache.reopen(path + '.0')
+			assert ttl_cache.get('a') == (None, False)
+			ttl_cache.set('b', 2)
+			assert ttl_cache.db is not None
+			ttl_cache.db.close()
+			ttl_cache = TTLCache(ttl=60, max_size=2, path=path)
+			assert list(ttl_cache.entries) == ['a']
+			assert ttl_cache.db is not None
+			ttl_cache.db.close()
+
+
+class TestRevalidate(unittest.TestCase):
+	url = 'https://www.pathofexile.com/character-window/get-passive-skills'
+
+	def test_not_modified_returns_the_cached_entry(self) -> None:
+		cached = {'validators': {'etag': '"1"'}, 'body': '{}'}
+		with unittest.mock.patch.object(stats.client, 'get', return_value=httpx.Response(304)) as get:
+			assert stats._revalidate('GET', self.url, {}, cached) is cached
+		assert get.call_args.kwargs['headers'] == {'If-None-Match': '"1"'}
+
+	def test_modified_replaces_the_cached_entry(self) -> None:
+		cached = {'validators': {'etag': '"1"'}, 'body': '{}'}
+		response = httpx.Response(200, headers={'ETag': '"2"'}, text='{"hashes": []}',
+				request=httpx.Request('GET', self.url))
+		with unittest.mock.patch.object(stats.client, 'get', return_value=response):
+			entry = stats._revalidate('GET', self.url, {}, cached)
+		assert entry == {'validators': {'etag': '"2"'}, 'body': '{"hashes": []}'}
+
+
+class TestSingleFlight(unittest.TestCase):
+	def run_concurrently(self, result: Exception | str) -> tuple[int, list[Exception | str]]:
+		""" Makes 5 calls with the same key while the first one is running, returns the executions and the results """
+		flight = SingleFlight()
+		started, release = threading.Event(), threading.Event()
+		executions = []
+		def leader() -> str:
+			executions.append('leader')
+			started.set()
+			release.wait()
+			if isinstance(result, Exception):
+				raise result
+			return result
+		def follower() -> str:
+			executions.append('follower')
+			return 'follower'
+
+		results: list[Exception | str] = []
+		def call(fn) -> None:
+			try:
+				results.append(flight.do('key', fn))
+			except Exception as e:
+				results.append(e)
+		threads = [threading.Thread(target=call, args=(leader,))]
+		threads[0].start()
+		started.wait()
+		threads += [threading.Thread(target=call, args=(follower,)) for _ in range(4)]
+		for thread in threads[1:]:
+			thread.start()
+		# let the followers get to waiting for the leader
+		time.sleep(0.1)
+		release.set()
+		for thread in threads:
+			thread.join()
+		assert flight.calls == {}
+		return len(executions), results
+
+	def test_concurrent_calls_run_once(self) -> None:
+		executions, results = self.run_concurrently('result')
+		assert executions == 1
+		assert results == ['result'] * 5
+
+	def test_every_caller_gets_the_exception(self) -> None:
+		error = ValueError('upstream failed')
+		executions, results = self.run_concurrently(error)
+		assert executions == 1
+		assert results == [error] * 5
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+	def test_concurrent_calls_run_once(self) -> None:
+		executions = []
+		async def fetch(result: str) -> str:
+			executions.append(result)
+			await asyncio.sleep(0)
+			return result
+		async def main() -> list[str]:
+			flight = AsyncSingleFlight()
+			results = await asyncio.gather(*(flight.do('key', fetch, f'call {i}') for i in range(5)))
+			assert flight.calls == {}
+			return results
+		assert asyncio.run(main()) == ['call 0'] * 5
+		assert executions == ['call 0']
+
+	def test_every_caller_gets_the_exception(self) -> None:
+		async def fail() -> None:
+			await asyncio.sleep(0)
+			raise ValueError('upstream failed')
+		async def main() -> list[BaseException | None]:
+			flight = AsyncSingleFlight()
+			return await asyncio.gather(*(flight.do('key', fail) for _ in range(3)), return_exceptions=True)
+		results = asyncio.run(main())
+		assert all(isinstance(result, ValueError) for result in results)
+
+	def test_a_cancelled_caller_does_not_cancel_the_others(self) -> None:
+		async def fetch() -> str:
+			await asyncio.sleep(0.01)
+			return 'result'
+		async def main() -> str:
+			flight = AsyncSingleFlight()
+			cancelled = asyncio.ensure_future(flight.do('key', fetch))
+			waiting = asyncio.ensure_future(flight.do('key', fetch))
+			await asyncio.sleep(0)
+			cancelled.cancel()
+			return await waiting
+		assert asyncio.run(main()) == 'result'
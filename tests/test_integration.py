@@ -1,12 +1,23 @@
 import os
+import random
 import unittest
 import warnings
 from typing import Optional
 
 import data
 from auras import Auras
-from gems import GemQualityType, parse_skills_in_item
-from stats import Stats, _parse_item, stats_for_character
+from gems import GemQualityType, Result, SkillGem, effect_lines, parse_skills_in_item
+from jewels import (
+	RadiusIndex,
+	TreeGraph,
+	alt_keystones,
+	in_radius,
+	nodes_in_radius,
+	notable_hashes_for_jewels,
+	passive_node_coordinates,
+	search_timeless_seeds,
+)
+from stats import Stats, _parse_item, hash_for_notable, passive_skill_tree, stats_for_character
 
 gem_data, _, _ = data.load()
 
@@ -357,6 +368,148 @@ class TestAuras(unittest.TestCase):
 		with warnings.catch_warnings(record=True):
 			stats_for_character(character, skills, False)  # just test that there's no exception
 
+	def test_tree_is_not_shared_between_requests(self) -> None:
+		tree, _ = passive_skill_tree(False)
+		tree['nodes']['60781']['stats'] = []  # Inspiring Bond
+		tree, _ = passive_skill_tree(False)
+		assert tree['nodes']['60781']['stats'] == ['Link Skills have 20% increased Buff Effect']
+
+	def test_results_describe_their_gem(self) -> None:
+		item = create_item([], [create_gem('Determination', 20, 20), create_gem('Generosity Support', 20, 0)])
+		active_skills = parse_skills_in_item(item, Stats())
+		result = active_skills[0].get_aura(False)
+		assert isinstance(result, Result)
+		assert result.source['name'] == 'Determination'
+		assert result.source['level'] == 20
+		assert result.source['supports'] == [{'name': 'Generosity Support', 'level': 20}]
+		assert result[0].startswith('// Determination (lvl 20, 20%) (Generosity Support 20)')
+
+	def test_gem_effects_are_cached(self) -> None:
+		item = create_item([], [create_gem('Determination', 20, 20)])
+		first = parse_skills_in_item(item, Stats())[0].get_aura(False)
+		hits = effect_lines.hits
+		second = parse_skills_in_item(item, Stats())[0].get_aura(False)
+		assert effect_lines.hits == hits + 1
+		assert second == first
+		second.append('changing a result must not change the cached lines')
+		assert parse_skills_in_item(item, Stats())[0].get_aura(False) == first
+
+	def test_aura_sweep_matches_get_aura(self) -> None:
+		item = create_item([], [create_gem('Determination', 20, 20)])
+		sweep = parse_skills_in_item(item, Stats())[0].sweep_aura(False, [0, 50])
+		assert sweep is not None
+		assert sweep['effect'][1] == sweep['effect'][0] + 50
+		char_stats = Stats()
+		char_stats.aura_effect = 50
+		expected = parse_skills_in_item(item, char_stats)[0].get_aura(False)
+		lines = [line['line'].replace('#', str(line['values'][0][1])) for line in sweep['lines']]
+		assert lines == expected[1:]
+
+	def test_legion_passives_are_prepared(self) -> None:
+		for keystone in alt_keystones.values():
+			assert data.legion_passive_mapping()[keystone]
+
+	def test_timeless_seed_search_ranks_seeds_by_weighted_stats(self) -> None:
+		tree, _ = passive_skill_tree(False)
+		jewel_type = data.TimelessJewelType.MILITANT_FAITH
+		socket = notable_hashes_for_jewels[0]
+		allocated = frozenset(tree['nodes'])
+		weights = {stat: 1 for stat in data.timeless_stats()}
+		seeds = search_timeless_seeds(jewel_type, socket, allocated, weights, tree, top=5)
+		scores = [score for _, score in seeds]
+		assert len(seeds) == 5
+		assert scores == sorted(scores, reverse=True)
+		mapping = data.timeless_node_mapping(seeds[0][0], jewel_type)
+		in_radius = nodes_in_radius(tree['nodes'][socket], 1800, tree)
+		assert any(mapping[passive]['mods'] for passive in in_radius if passive in mapping)
+		# without weights every seed ties, so the lowest seeds come first
+		seeds = search_timeless_seeds(jewel_type, socket, allocated, {}, tree, top=5)
+		all_seeds = data.timeless_seed_columns(jewel_type, []).seeds
+		assert seeds == [(int(seed), 0.0) for seed in sorted(all_seeds)[:5]]
+
+	def test_split_personality_distance_only_uses_allocated_passives(self) -> None:
+		# 1 - 2 - 3 - 4 is the long way around, 1 - 5 - 4 isn't allocated
+		tree = {'nodes': {
+			'1': {'out': ['2', '5']}, '2': {'out': ['3']}, '3': {'out': ['4']}, '4': {'in': ['5']}, '5': {},
+			'6': {'out': ['4']},
+		}}
+		distances = TreeGraph(tree).distances_from({'1'}, frozenset({'1', '2', '3', '4'}))
+		assert distances == {'1': 0, '2': 1, '3': 2, '4': 3}
+		distances = TreeGraph(tree).distances_from({'1', '6'}, frozenset({'1', '2', '3', '4', '6'}))
+		assert distances['4'] == 1
+
+	def test_radius_index_matches_checking_every_passive(self) -> None:
+		rng = random.Random(0)
+		tree: dict = {'constants': {'orbitRadii': [0, 82, 162, 335], 'skillsPerOrbit': [1, 6, 16, 16]}, 'groups': {},
+				'nodes': {}}
+		for group in range(1, 60):
+			tree['groups'][str(group)] = {'x': rng.uniform(-4000, 4000), 'y': rng.uniform(-4000, 4000)}
+			for orbit in range(4):
+				node_hash = str(len(tree['nodes']) + 1)
+				tree['nodes'][node_hash] = {'skill': int(node_hash), 'name': 'Passive', 'group': group, 'orbit': orbit,
+						'orbitIndex': rng.randrange(tree['constants']['skillsPerOrbit'][orbit])}
+		# none of these can be affected by jewels
+		tree['nodes']['1']['isJewelSocket'] = True
+		tree['nodes']['2']['name'] = 'Life Mastery'
+		tree['nodes']['3']['classStartIndex'] = 0
+		tree['nodes']['4']['group'] = 0
+		tree['nodes']['5'] = {'skill': 5, 'name': 'Ascendancy root'}
+		tree['groups']['0'] = {'x': 0, 'y': 0}
+		affected = [int(node_hash) for node_hash in tree['nodes'] if int(node_hash) > 5]
+
+		index = RadiusIndex(tree)
+		for middle in rng.sample(affected, 20):
+			middle_passive = tree['nodes'][str(middle)]
+			middle_coordinates = passive_node_coordinates(middle_passive, tree)
+			for radius in (800, 1200, 1500, 1800):
+				expected = {node_hash for node_hash in affected if in_radius(middle_coordinates,
+						passive_node_coordinates(tree['nodes'][str(node_hash)], tree), radius)}
+				assert index.nodes_in_radius(middle_passive, radius) == expected
+
+	def test_allocated_notable_wins_over_passives_with_the_same_name(self) -> None:
+		tree = {'nodes': {
+			'1': {'name': 'Dupe'}, '2': {'name': 'Dupe', 'isNotable': True},
+			'3': {'name': 'Socket', 'expansionJewel': {}}, '4': {'name': 'Socket'},
+		}}
+		assert hash_for_notable('Dupe', tree) == '2'
+		assert hash_for_notable('Socket', tree) == '4'
+		with self.assertRaises(FileNotFoundError):
+			hash_for_notable('Missing', tree)
+
+	def test_translation_rules_are_compiled(self) -> None:
+		translations = [
+			{'condition': [{'min': 1, 'max': None}], 'format': ['+#'], 'index_handlers': [['divide_by_one_hundred']],
+				'string': 'You and nearby Allies have {0}% to all Resistances'},
+			{'condition': [{'min': None, 'max': -1}], 'format': ['#'], 'index_handlers': [['negate']],
+				'string': 'Aura grants {0}% reduced Damage taken'},
+		]
+		table = {'stat': tuple(map(data.TranslationRule.from_record, data.compile_translations(translations)))}
+		rule, values = SkillGem.translate('stat', 150, [], 20, table)
+		assert rule is not None and rule.aura is not None
+		assert rule.render(rule.aura, values) == '+1.8% to all Resistances'
+		rule, values = SkillGem.translate('stat', -5, [], 0, table)
+		assert rule is not None and rule.aura is not None
+		assert rule.render(rule.aura, values) == '5% reduced Damage taken'
+		assert SkillGem.translate('stat', 0, [], 0, table) == (None, [])
+
+	def test_curse_mine_and_link_rewrites_are_compiled(self) -> None:
+		translations = [
+			{'condition': [{}], 'format': ['+#'], 'index_handlers': [[]],
+				'string': 'Cursed Enemies have {0}% to Chaos Resistance'},
+			{'condition': [{}], 'format': ['#', '#'], 'index_handlers': [[]],
+				'string': 'Each Mine applies {0}% increased Critical Strike Chance to Hits against Enemies near it, up '
+					'to a maximum of {1}%'},
+			{'condition': [{}], 'format': ['#'], 'index_handlers': [[]],
+				'string': 'Linked target gains Added Fire Damage equal to {0}% of your Maximum Life'},
+		]
+		curse, mine, link = map(data.TranslationRule.from_record, data.compile_translations(translations))
+		assert curse.curse == ('Nearby Enemies have +{0}% to Chaos Resistance',)
+		assert mine.mine == '{0}% increased Critical Strike Chance'
+		assert mine.mine_caps == ((0, 1),)
+		assert link.link == '{0} to {0} Added Fire Damage'
+		assert link.link_life_percent == 0
+		assert curse.mine is None and mine.link is None and link.curse is None
+
 
 def string_in_result_array(string: str, result_array: list[list[str]]):
 	for subarray in result_array:
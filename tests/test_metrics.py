@@ -0,0 +1,33 @@
+import unittest
+import unittest.mock
+
+import metrics
+
+class TestMetrics(unittest.TestCase):
+	def test_server_timing_adds_up_repeated_stages(self) -> None:
+		spans = [('fetch', 0.0123), ('analysis', 0.1), ('fetch', 0.001)]
+		assert metrics.server_timing(spans) == 'fetch;dur=13.3, analysis;dur=100.0'
+		assert metrics.server_timing([]) == ''
+
+	def test_prometheus_histograms_are_cumulative(self) -> None:
+		with unittest.mock.patch.dict(metrics.stage_durations, clear=True):
+			with metrics.collect_spans() as spans:
+				metrics.record('render', 0.003)
+				metrics.record('render', 0.02)
+			assert spans == [('render', 0.003), ('render', 0.02)]
+			lines = metrics.prometheus({'poecalc_result_cache_hits_total': 7}).splitlines()
+		assert lines[:2] == [
+			'# HELP poecalc_stage_duration_seconds Time spent in each stage of a request',
+			'# TYPE poecalc_stage_duration_seconds histogram',
+		]
+		assert 'poecalc_stage_duration_seconds_bucket{stage="render",le="0.0025"} 0' in lines
+		assert 'poecalc_stage_duration_seconds_bucket{stage="render",le="0.005"} 1' in lines
+		assert 'poecalc_stage_duration_seconds_bucket{stage="render",le="0.025"} 2' in lines
+		assert 'poecalc_stage_duration_seconds_bucket{stage="render",le="10.0"} 2' in lines
+		assert lines[-5:] == [
+			'poecalc_stage_duration_seconds_bucket{stage="render",le="+Inf"} 2',
+			'poecalc_stage_duration_seconds_sum{stage="render"} 0.023',
+			'poecalc_stage_duration_seconds_count{stage="render"} 2',
+			'# TYPE poecalc_result_cache_hits_total counter',
+			'poecalc_result_cache_hits_total 7',
+		]
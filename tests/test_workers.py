@@ -0,0 +1,36 @@
+import os
+import threading
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from workers import BoundedPool, Saturated
+
+class TestBoundedPool(unittest.TestCase):
+	def setUp(self) -> None:
+		self.pool = BoundedPool(workers=1, queue_depth=1)
+
+	def tearDown(self) -> None:
+		self.pool.shutdown()
+
+	def test_calls_past_the_queue_depth_are_shed(self) -> None:
+		# one call runs and one waits for the worker
+		threads = [threading.Thread(target=self.pool.run, args=(time.sleep, 1)) for _ in range(2)]
+		for thread in threads:
+			thread.start()
+		while self.pool.in_flight < 2:
+			time.sleep(0.01)
+		with self.assertRaises(Saturated):
+			self.pool.run(abs, -1)
+		assert self.pool.shed == 1
+		for thread in threads:
+			thread.join()
+		assert self.pool.in_flight == 0
+		assert self.pool.run(abs, -1) == 1
+
+	def test_a_new_pool_is_started_after_a_worker_died(self) -> None:
+		with self.assertRaises(BrokenProcessPool):
+			self.pool.run(os._exit, 1)
+		assert self.pool.executor is None
+		assert self.pool.in_flight == 0
+		assert self.pool.run(abs, -1) == 1
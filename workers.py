@@ -0,0 +1,55 @@
+""" Runs CPU-bound work in other processes so it doesn't block the event loop of the server """
+import concurrent.futures
+import multiprocessing
+import threading
+from collections.abc import Callable
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Optional, TypeVar
+
+T = TypeVar('T')
+
+class Saturated(Exception):
+	pass
+
+class BoundedPool:
+	"""
+	Process pool that runs at most workers calls at a time and lets at most queue_depth more wait for a worker.
+	Calls beyond that raise Saturated right away instead of queueing up behind slow ones
+	"""
+	def __init__(self, workers: int, queue_depth: int) -> None:
+		self.workers = workers
+		self.max_in_flight = workers + queue_depth
+		self.in_flight = 0
+		self.shed = 0
+		self.lock = threading.Lock()
+		# started on first use, so every pre-forked server process gets its own
+		self.executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+	def run(self, fn: Callable[..., T], *args: Any) -> T:
+		with self.lock:
+			if self.in_flight >= self.max_in_flight:
+				self.shed += 1
+				raise Saturated
+			self.in_flight += 1
+			if self.executor is None:
+				# the data.db connections can't be shared with forked processes
+				self.executor = concurrent.futures.ProcessPoolExecutor(self.workers,
+						mp_context=multiprocessing.get_context('spawn'))
+			executor = self.executor
+		try:
+			return executor.submit(fn, *args).result()
+		except BrokenProcessPool:
+			# a worker died (e.g. it was OOM killed), so start a new pool for the next call
+			with self.lock:
+				if self.executor is executor:
+					self.executor = None
+			raise
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+	def shutdown(self) -> None:
+		with self.lock:
+			executor, self.executor = self.executor, None
+		if executor is not None:
+			executor.shutdown(cancel_futures=True)